@@ -1,13 +1,23 @@
 #!/usr/bin/env python
 #
 # splits multi-fasta file into single, with 
+#
+# or, with -s N, into N balanced shards plus an accession -> shard index:
+#   fastasplit.py -s 500 -b residues -w ./uniprot uniprot_sprot.fasta
+#   -> ./uniprot/shard.1.fasta ... shard.500.fasta, shard.idx, shard.list
 
 import argparse
+import itertools
 import logging
 import os
 import sys
 import traceback
 
+gitpath=os.path.expanduser("~/git/cshl-work")
+sys.path.append(gitpath)
+
+from utils.fastatool import read_fasta, shard_fasta
+
 class NumSeqReachedException(Exception):
     pass
 
@@ -17,27 +27,38 @@ class Sequence(object):
     def __init__(self, accession, geneid, sequence=""):
         self.accession = accession
         self.geneid = geneid
-        self.sequence = sequence
+        self.chunks = [ sequence ]
+
+    @property
+    def sequence(self):
+        if len(self.chunks) > 1:
+            self.chunks = [ ''.join(self.chunks) ]
+        return self.chunks[0]
 
     def addsequence(self, sequence):
-        self.sequence += sequence
+        self.chunks.append(sequence)
         
     def asfasta(self):
-        s = ">%s|%s\n%s" % ( self.accession, self.geneid, self.sequence)
+        s = ">%s|%s\n%s\n" % ( self.accession, self.geneid, self.sequence)
         return s
 
 
 class ProcessingRun(object):
     
-    def __init__(self, filelist, workdir, numseq):
+    def __init__(self, filelist, workdir, numseq, nshards=None, balance='count'):
         self.log = logging.getLogger()
         self.filelist = filelist
+        self.nshards = nshards
+        self.balance = balance
         self.workdir = os.path.expanduser(workdir)
         self.workdir = os.path.abspath(self.workdir)
         if not os.path.exists(self.workdir):
             os.mkdir(self.workdir)
             self.log.info("Created workdir %s" % self.workdir)
-        self.numseq = int(numseq)
+        # shards take all records unless limited. 
+        if numseq is None and nshards is None:
+            numseq = 100
+        self.numseq = None if numseq is None else int(numseq)
         self.numoutput = 0
 
     def outputlast(self, seq):
@@ -56,36 +77,39 @@ class ProcessingRun(object):
     
     
     def parsefile(self, filehandle):
-        current = None
         try:
-            for line in filehandle:
-                if line.startswith(">"):
-                    if current is not None:
-                        current.addsequence("\n")
-                        self.outputlast(current)
-                        if self.numoutput >= self.numseq:
-                            raise NumSeqReachedException
-                    
-                    fields = line.split("|")
-                    accession = fields[1]
-                    fields2 = fields[2].split()
-                    geneid = fields2[0]
-                    logging.debug('header: accessno=%s id=%s' % (accession, geneid))
-                    current = Sequence(accession, geneid)
-                elif line.strip().startswith("#"):
-                    pass
-                else:
-                    s = line.strip()
-                    current.addsequence(s)        
+            for rec in read_fasta(filehandle):
+                logging.debug('header: accessno=%s id=%s' % (rec.accession, rec.pid))
+                self.outputlast(Sequence(rec.accession, rec.pid, rec.sequence))
+                if self.numoutput >= self.numseq:
+                    raise NumSeqReachedException
         except NumSeqReachedException:
             raise
             
-        
         except Exception as e:
             traceback.print_exc(file=sys.stdout)        
 
     
+    def iterrecords(self):
+        for filename in self.filelist:
+            filename = os.path.abspath(filename)
+            if not os.path.exists(filename):
+                self.log.error("No such file %s" % filename)
+                continue
+            self.log.debug("opening file %s" % filename)
+            yield from read_fasta(filename)
+
+    def handleshards(self):
+        records = self.iterrecords()
+        if self.numseq is not None:
+            records = itertools.islice(records, self.numseq)
+        shardlist = shard_fasta(records, self.workdir, self.nshards, balance=self.balance)
+        self.log.info("Wrote %d shards to %s" % (len(shardlist), self.workdir))
+
     def handlefiles(self):     
+        if self.nshards is not None:
+            self.handleshards()
+            return
         for filename in self.filelist:
             filename = os.path.abspath(filename)
                         
@@ -131,9 +155,23 @@ if __name__ == '__main__':
     parser.add_argument('-n', '--numseq', 
                         action="store", 
                         dest='numseq', 
-                        default=100,
-                        help='number of sequences to process. ')    
+                        default=None,
+                        help='number of sequences to process [100, all with -s]')    
     
+
+    parser.add_argument('-s', '--shards', 
+                        action="store", 
+                        dest='shards', 
+                        type=int,
+                        default=None,
+                        help='write N shard files instead of one file per sequence. ')    
+
+    parser.add_argument('-b', '--balance', 
+                        action="store", 
+                        dest='balance', 
+                        choices=['count', 'residues'],
+                        default='count',
+                        help='balance shards by record count or total residues [count]')    
                   
     args= parser.parse_args()
     
@@ -143,7 +181,7 @@ if __name__ == '__main__':
         logging.getLogger().setLevel(logging.INFO)
     
     filelist = args.infiles 
-    run = ProcessingRun(filelist, args.workdir, args.numseq)
+    run = ProcessingRun(filelist, args.workdir, args.numseq, args.shards, args.balance)
     run.handlefiles()
 
 
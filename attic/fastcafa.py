@@ -138,40 +138,27 @@ def do_evaluate_map(config, predictdf, goaspect):
     
     """
     logging.debug(f"got predictdf {predictdf}evaluating...")
-    ubgo = get_uniprot_bygene_object(config, usecache=True)
-    ontobj = get_ontology_object(config, usecache=True)
-    logging.debug(f"got known uniprot and ontology object.")
-    
-    cidlist = list(predictdf.cid.unique())
-    logging.debug(f"cid list: {cidlist}")
-    
-    listoflists = []
-        
-    for cid in cidlist:
-        cdf = predictdf[predictdf.cid == cid]
-        # get gene id. 
-        cgid = cdf.cgid.unique()[0]
-        #logging.debug(f"geneid for this target is is {cgid}")
-        
-        numcorrect = 0
-
-        numseen = 0
-        apsum = 0
-        
-        for (i, row) in cdf.iterrows():
-            # ser is the row.
-            #logging.debug(f"goterm is {row.goterm}")
-            iscorrect = ubgo.contains(cgid, row.goterm) 
-            numseen += 1 
-            if iscorrect:
-                numcorrect += 1
-                prec = numcorrect / numseen 
-                apsum = apsum + prec
-        map = apsum / numseen  
-        newrow = [ cid,  cgid, map, numseen ]
-        listoflists.append(newrow)    
-    
-    df = pd.DataFrame(listoflists, columns=['cid','cgid','map', 'numgt'])
+    truthdf = get_uniprot_bygene_truthdf(config, usecache=True)
+    logging.debug(f"got known (cgid, goterm) truth set, length={len(truthdf)}")
+
+    # score every prediction against the target gene of its cid in one merge.
+    pdf = predictdf[['cid','goterm','cgid']].reset_index(drop=True)
+    pdf['cgid'] = pdf.groupby('cid', sort=False)['cgid'].transform('first')
+    pdf = pdf.merge(truthdf, on=['cgid','goterm'], how='left', indicator=True)
+    pdf['correct'] = pdf['_merge'] == 'both'
+    logging.debug(f"labelled {pdf.correct.sum()} of {len(pdf)} predictions correct.")
+
+    # cumulative precision at each correct prediction, in file order per cid.
+    grouped = pdf.groupby('cid', sort=False)
+    numseen = grouped.cumcount() + 1
+    numcorrect = grouped['correct'].cumsum()
+    pdf['prec'] = np.where(pdf['correct'], numcorrect / numseen, 0.0)
+
+    df = pdf.groupby('cid', sort=False).agg(cgid=('cgid','first'),
+                                             apsum=('prec','sum'),
+                                             numgt=('prec','size'))
+    df['map'] = df['apsum'] / df['numgt']
+    df = df.reset_index()[['cid','cgid','map','numgt']]
     return df
 
 
@@ -205,6 +192,304 @@ def run_evaluate_map(config, predictfile, outfile, goaspect=None):
 
 
 
+def save_arrays(dirpath, arrays):
+    """
+    One <name>.npy per array in dirpath, so each can be memory-mapped on its own. 
+    """
+    os.makedirs(dirpath, exist_ok=True)
+    for (name, a) in arrays.items():
+        np.save(f"{dirpath}/{name}.npy", a, allow_pickle=False)
+
+
+def load_arrays(dirpath):
+    """
+    dict name -> read-only memory-mapped array, for all .npy files in dirpath. 
+    """
+    return { os.path.basename(fp)[:-len('.npy')] : np.load(fp, mmap_mode='r') 
+             for fp in sorted(glob.glob(f"{glob.escape(dirpath)}/*.npy")) }
+
+
+class ArtifactCache(object):
+    """
+    Versioned cache for build_* artifacts under [uniprot] cachedir. 
+    
+    Each artifact is stored as <cachedir>/<name>.<key>.<ext>, where key is a digest of 
+    the input files and config values it was built from. Changing an input file or 
+    a relevant config value produces a new key, so stale versions are never loaded, and 
+    are evicted when the new version is stored. 
+    
+    DataFrames are stored as uncompressed Feather. Load memory-maps the file and converts 
+    only the requested columns to pandas, which copies them into memory; ask for just 
+    the columns needed. Other artifacts (GoVectorIndex, UniprotStore) save themselves as 
+    a directory <name>.<key>.arrays of .npy files, memory-mapped on load.  
+    
+    Input files are fingerprinted by path, size and mtime unless contenthash=True, in which 
+    case their contents are hashed (slow for TrEMBL-sized inputs). 
+    
+    """
+    def __init__(self, config, contenthash=False):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.cachedir = os.path.expanduser(config.get('uniprot','cachedir'))
+        self.contenthash = contenthash
+        if not os.path.exists(self.cachedir):
+            os.makedirs(self.cachedir)
+            self.log.debug(f"created cachedir {self.cachedir}")
+
+    def __repr__(self):
+        return f"ArtifactCache: cachedir={self.cachedir} contenthash={self.contenthash}"
+
+    def fingerprint(self, filepath):
+        filepath = os.path.abspath(os.path.expanduser(filepath))
+        h = hashlib.sha1(filepath.encode())
+        if self.contenthash:
+            with open(filepath, 'rb') as f:
+                for chunk in iter(lambda: f.read(1048576), b''):
+                    h.update(chunk)
+        else:
+            st = os.stat(filepath)
+            h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+        return h.hexdigest()
+
+    def make_key(self, config, sections):
+        """
+        Digest of all values in the given config sections, plus fingerprints of any 
+        values that name existing files. 
+        """
+        h = hashlib.sha1()
+        for section in sections:
+            if not config.has_section(section):
+                continue
+            for (k, v) in sorted(config.items(section)):
+                h.update(f"[{section}]{k}={v}\n".encode())
+                fp = os.path.expanduser(v)
+                if os.path.isfile(fp):
+                    h.update(self.fingerprint(fp).encode())
+        return h.hexdigest()[:16]
+
+    def find(self, name, key):
+        for ext in ['feather', 'arrays']:
+            filepath = f"{self.cachedir}/{name}.{key}.{ext}"
+            if os.path.exists(filepath):
+                return filepath
+        return None
+
+    def load(self, name, key, columns=None, loader=None):
+        """
+        Returns cached artifact, or None on miss. 
+        columns restricts which Feather columns are read. 
+        loader(filepath) reads .arrays artifacts, default GoVectorIndex.load 
+        """
+        filepath = self.find(name, key)
+        if filepath is None:
+            return None
+        self.log.debug(f"cache hit for {name} key={key}: {filepath}")
+        if filepath.endswith('.feather'):
+            table = feather.read_table(filepath, columns=columns, memory_map=True)
+            # one block per column, so no consolidation copy on top of conversion.
+            return table.to_pandas(split_blocks=True)
+        elif loader is not None:
+            return loader(filepath)
+        else:
+            return GoVectorIndex.load(filepath)
+
+    def store(self, name, key, obj):
+        if isinstance(obj, pd.DataFrame):
+            filepath = f"{self.cachedir}/{name}.{key}.feather"
+            tmppath = f"{filepath}.tmp"
+            obj.reset_index(drop=True).to_feather(tmppath, compression='uncompressed')
+        else:
+            filepath = f"{self.cachedir}/{name}.{key}.arrays"
+            tmppath = f"{filepath}.tmp"
+            for path in [tmppath, filepath]:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+            obj.save(tmppath)
+        os.replace(tmppath, filepath)
+        self.log.debug(f"stored {name} key={key} to {filepath}")
+        self.evict(name, keep=key)
+        return filepath
+
+    def evict(self, name, keep=None):
+        """
+        Remove all cached versions of name, except key keep. 
+        """
+        for filepath in glob.glob(f"{self.cachedir}/{name}.*"):
+            fkey = os.path.basename(filepath)[len(name) + 1:].split('.')[0]
+            if fkey != keep:
+                self.log.debug(f"evicting stale {filepath}")
+                if os.path.isdir(filepath):
+                    shutil.rmtree(filepath)
+                else:
+                    os.remove(filepath)
+
+    def get(self, name, builder, config, sections, usecache=True, columns=None, loader=None):
+        """
+        Load name from cache if current, otherwise builder(config), store and return it. 
+        """
+        key = self.make_key(config, sections)
+        obj = None
+        if usecache:
+            obj = self.load(name, key, columns=columns, loader=loader)
+        if obj is None:
+            self.log.debug(f"cache miss for {name} key={key}. building...")
+            obj = builder(config)
+            self.store(name, key, obj)
+            if columns is not None:
+                obj = obj[columns]
+        return obj
+
+
+class UniprotStore(object):
+    """
+    Normalized columnar store of UniProt proteins and their GO annotations. 
+    
+    proteins:   DataFrame, one row per protein
+           proteinacc   proteinid protein species  taxonid  gene  seqoffset  seqlength
+        0      Q6GZX4  001R_FRG3G    001R   FRG3G   654924  None          0        256
+        
+    residues:   uint8 array, all sequences concatenated. 
+                sequence i is residues[seqoffset[i] : seqoffset[i] + seqlength[i]]
+    
+    annotations: DataFrame of integer codes, one row per (protein, goterm)
+           prow  gtcode  evcode
+        0     0       0       0
+        
+    gotermlist, evcodelist:  code -> string lookups for annotations. 
+    
+    """
+    def __init__(self, proteins, residues, annotations, gotermlist, evcodelist):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.proteins = proteins
+        self.residues = residues
+        self.annotations = annotations
+        self.gotermlist = np.asarray(gotermlist)
+        self.evcodelist = np.asarray(evcodelist)
+        self.accidx = None
+
+    def __repr__(self):
+        s = f"UniprotStore: {len(self.proteins)} proteins, {len(self.annotations)} annotations, "
+        s += f"{len(self.residues)} residues."
+        return s
+
+    def __len__(self):
+        return len(self.proteins)
+
+    def get_row(self, proteinacc):
+        """
+        Row number for accession. Raises KeyError. 
+        """
+        if self.accidx is None:
+            self.accidx = pd.Index(self.proteins['proteinacc'])
+        return self.accidx.get_loc(proteinacc)
+
+    def get_sequence(self, proteinacc):
+        i = self.get_row(proteinacc)
+        start = self.proteins['seqoffset'].values[i]
+        end = start + self.proteins['seqlength'].values[i]
+        return self.residues[start:end].tobytes().decode()
+
+    def get_annotations(self, proteinacc):
+        """
+        DataFrame of goterm, goev for one accession.  
+        """
+        i = self.get_row(proteinacc)
+        adf = self.annotations[self.annotations['prow'].values == i]
+        return pd.DataFrame({ 'goterm' : self.gotermlist[adf['gtcode'].values],
+                              'goev'   : self.evcodelist[adf['evcode'].values] })
+
+    def get_proteins_with_goterm(self, goterm):
+        """
+        Protein table rows annotated (directly) with goterm. 
+        """
+        codes = np.flatnonzero(self.gotermlist == goterm)
+        prows = self.annotations['prow'].values[np.isin(self.annotations['gtcode'].values, codes)]
+        return self.proteins.iloc[np.unique(prows)]
+
+    def to_df(self, sequence=False):
+        """
+        Flat (protein, goterm) frame, one row per annotation, as build_uniprot_test 
+        used to produce. Sequences only included if asked for. 
+        """
+        prows = self.annotations['prow'].values
+        pdf = self.proteins.iloc[prows].reset_index(drop=True)
+        df = pd.DataFrame({ 'proteinacc' : pdf['proteinacc'],
+                            'protein'    : pdf['protein'],
+                            'species'    : pdf['species'],
+                            'goterm'     : self.gotermlist[self.annotations['gtcode'].values],
+                            'goev'       : self.evcodelist[self.annotations['evcode'].values],
+                            'seqlength'  : pdf['seqlength'] })
+        if sequence:
+            df['sequence'] = [ self.residues[o:o + l].tobytes().decode() 
+                               for (o, l) in zip(pdf['seqoffset'], pdf['seqlength']) ]
+        return df
+
+    def save(self, dirpath):
+        """
+        Directory of .npy files, one per array or table column. 
+        """
+        arrays = { f"protein_{c}" : self.proteins[c].to_numpy() for c in self.proteins.columns }
+        for c in ['proteinacc','proteinid','protein','species','gene']:
+            arrays[f"protein_{c}"] = self.proteins[c].fillna('').to_numpy().astype(str)
+        for c in self.annotations.columns:
+            arrays[f"annotation_{c}"] = self.annotations[c].to_numpy()
+        arrays['residues'] = np.asarray(self.residues, dtype=np.uint8)
+        arrays['gotermlist'] = self.gotermlist.astype(str)
+        arrays['evcodelist'] = self.evcodelist.astype(str)
+        save_arrays(dirpath, arrays)
+        self.log.debug(f"saved {self} to {dirpath}")
+
+    @classmethod
+    def load(cls, dirpath):
+        """
+        Residues stay memory-mapped. Table columns are copied into DataFrames.  
+        """
+        arrays = load_arrays(dirpath)
+        proteins = pd.DataFrame({ k[len('protein_'):] : a for (k, a) in arrays.items() if k.startswith('protein_') })
+        proteins['gene'] = proteins['gene'].replace({ '' : None })
+        proteins['species'] = proteins['species'].astype('category')
+        annotations = pd.DataFrame({ k[len('annotation_'):] : a for (k, a) in arrays.items() if k.startswith('annotation_') })
+        return cls(proteins, arrays['residues'], annotations, arrays['gotermlist'], arrays['evcodelist'])
+
+
+def build_uniprot_store(config):
+    """
+    Single pass over build_uniprot() output, collecting protein columns, sequence bytes 
+    and annotation codes. Sequences are joined into one residue buffer at the end. 
+    """
+    lod = build_uniprot(config, usecache=True)
+    
+    cols = { 'proteinacc' : [], 'proteinid' : [], 'protein' : [], 'species' : [], 
+             'taxonid' : [], 'gene' : [], 'seqlength' : [] }
+    seqlist = []
+    prowlist = []
+    gtlist = []
+    evlist = []
+    for (i, p) in enumerate(lod):
+        for c in cols.keys():
+            cols[c].append(p.get(c))
+        seqlist.append(p['sequence'].encode())
+        gts = p['goterms']
+        prowlist.append(np.full(len(gts), i, dtype=np.int32))
+        gtlist.extend(gts.keys())
+        evlist.extend(gts.values())
+    
+    proteins = pd.DataFrame(cols)
+    proteins['species'] = proteins['species'].astype('category')
+    proteins['taxonid'] = pd.to_numeric(proteins['taxonid'], errors='coerce').fillna(-1).astype(np.int32)
+    proteins['seqlength'] = np.array([ len(sq) for sq in seqlist ], dtype=np.int64)
+    proteins['seqoffset'] = np.concatenate([[0], np.cumsum(proteins['seqlength'].values)[:-1]])
+    residues = np.frombuffer(b''.join(seqlist), dtype=np.uint8)
+    
+    (gtcodes, gotermlist) = pd.factorize(pd.Series(gtlist, dtype=object))
+    (evcodes, evcodelist) = pd.factorize(pd.Series(evlist, dtype=object))
+    annotations = pd.DataFrame({ 'prow'   : np.concatenate(prowlist) if prowlist else np.zeros(0, dtype=np.int32), 
+                                 'gtcode' : gtcodes.astype(np.int32), 
+                                 'evcode' : evcodes.astype(np.int8) })
+    ups = UniprotStore(proteins, residues, annotations, gotermlist.values, evcodelist.values)
+    logging.debug(f"built {ups}")
+    return ups
+
+
 def build_uniprot_test(config, usecache):
     """
    
@@ -221,53 +506,160 @@ def build_uniprot_test(config, usecache):
        .
     ]
    
-    Create redundant dataframe for later slimming. Include sequence. Cache. 
+    Create normalized protein/annotation store. Sequences held once, in a single residue 
+    buffer. Use .to_df() for the old redundant per-(protein, goterm) frame. Cache. 
    
     """    
-    cachedir = os.path.expanduser(config.get('uniprot','cachedir'))
-    cachefile = f"{cachedir}/uniprottest.pickle"    
-    lodt = None
+    cache = ArtifactCache(config)
+    ups = cache.get('uniprottest', build_uniprot_store, config, ['uniprot'], 
+                    usecache=usecache, loader=UniprotStore.load)
+    logging.debug(f"got uniprot test source {ups}")
+    return ups
+
+
+class GoVectorIndex(object):
+    """
+    Compact key -> propagated govector index. 
     
-    if os.path.exists(cachefile) and usecache:
-        logging.debug("Cache hit. Using existing info...")    
-        try:
-            cf = open(cachefile, 'rb')    
-            lodt = pickle.load(cf)
-        except Exception:
-            logging.error(f'unable to load via pickle from {cachefile}')
-            traceback.print_exc(file=sys.stdout)    
-        finally:
-            cf.close()       
-    else:    
-        lod = build_uniprot(config, usecache=True)
-
-        lodt = []
-        for p in lod:
-            newgts = {}
-            for gt in p['goterms'].keys():
-                evcode = p['goterms'][gt]
-                item = [ p['proteinacc'],
-                         p['protein'],
-                         p['species'],
-                         gt, 
-                         evcode,
-                         p['seqlength'],
-                         p['sequence'] 
-                      ]
-                lodt.append(item)
-                
-        logging.debug(f"saving listofdicts: to {cachefile}")
+    One CSR bool matrix of keys (pid or gene) x goterms, plus key -> row mapping. 
+    Rows are only expanded to dense vectors on request. 
+    
+    gvi['LRRK2']                    -> dense bool vector, len(gotermlist)
+    gvi.contains('LRRK2', 'GO:0008150')
+    gvi.union(['LRRK2','TF7L2'])    -> dense bool OR of rows
+    gvi.get('LRRK2')                -> dense bool vector, or None
+    'LRRK2' in gvi,  gvi.keys()     dict-style, as when this was a dict of govectors
+    
+    """
+    def __init__(self, keys, matrix, gotermlist):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.keylist = np.asarray(keys)
+        self.matrix = sparse.csr_matrix(matrix, dtype=bool)
+        self.gotermlist = np.asarray(gotermlist)
+        self.keyidx = { k : i for (i, k) in enumerate(self.keylist) }
+        self.gotermidx = { gt : i for (i, gt) in enumerate(self.gotermlist) }
+
+    def __repr__(self):
+        s = f"GoVectorIndex: {self.matrix.shape[0]} keys x {self.matrix.shape[1]} goterms, "
+        s += f"{self.matrix.nnz} entries."
+        return s
+
+    def __len__(self):
+        return len(self.keylist)
+
+    def __contains__(self, key):
+        return key in self.keyidx
+    
+    def __getitem__(self, key):
+        return self.get_vector(key)
+
+    def keys(self):
+        return self.keyidx.keys()
+
+    def get(self, key, default=None):
+        if key not in self.keyidx:
+            return default
+        return self.get_vector(key)
+
+    def get_vector(self, key):
+        """
+        Dense propagated bool govector for key.  Raises KeyError if unknown. 
+        """
+        i = self.keyidx[key]
+        gv = np.zeros(self.matrix.shape[1], dtype=bool)
+        gv[self.matrix.indices[self.matrix.indptr[i]:self.matrix.indptr[i + 1]]] = True
+        return gv
+
+    def get_rows(self, keylist):
+        """
+        CSR submatrix of rows for keys in keylist, in keylist order. Raises KeyError.  
+        """
+        rows = [ self.keyidx[k] for k in keylist ]
+        return self.matrix[rows]
+
+    def union(self, keylist):
+        """
+        Dense bool OR of all rows for keys in keylist. 
+        """
+        sub = self.get_rows(keylist)
+        gv = np.zeros(self.matrix.shape[1], dtype=bool)
+        gv[sub.indices] = True
+        return gv
+
+    def contains(self, key, goterm):
         try:
-            cf = open(cachefile, 'wb')    
-            pickle.dump(lodt, cf )
-            logging.debug(f"saved listofdicts: to {cachefile}")
-        except Exception as e:
-            logging.error(f'unable to dump via pickle to {cachefile}')
-            traceback.print_exc(file=sys.stdout)     
-        finally:
-            cf.close() 
-        logging.debug(f"created uniprot test source with {len(lodt)} entries.")
-    return lodt
+            i = self.keyidx[key]
+            j = self.gotermidx[goterm]
+        except KeyError:
+            return False
+        row = self.matrix.indices[self.matrix.indptr[i]:self.matrix.indptr[i + 1]]
+        return j in row
+
+    def goterms(self, key):
+        i = self.keyidx[key]
+        return list(self.gotermlist[self.matrix.indices[self.matrix.indptr[i]:self.matrix.indptr[i + 1]]])
+
+    def to_df(self, keyname='key'):
+        """
+        All (key, goterm) pairs as a DataFrame. 
+        """
+        coo = self.matrix.tocoo()
+        df = pd.DataFrame({ keyname  : self.keylist[coo.row], 
+                            'goterm' : self.gotermlist[coo.col] })
+        return df
+
+    def save(self, dirpath):
+        """
+        CSR components and labels as .npy files in dirpath. 
+        """
+        save_arrays(dirpath, { 'indptr'     : self.matrix.indptr, 
+                               'indices'    : self.matrix.indices,
+                               'shape'      : np.asarray(self.matrix.shape),
+                               'keys'       : self.keylist.astype(str), 
+                               'gotermlist' : self.gotermlist.astype(str) })
+        self.log.debug(f"saved {self} to {dirpath}")
+
+    @classmethod
+    def load(cls, dirpath):
+        """
+        CSR index arrays are memory-mapped, not read into memory. 
+        """
+        arrays = load_arrays(dirpath)
+        (nrows, ncols) = arrays['shape']
+        indices = arrays['indices']
+        matrix = sparse.csr_matrix((np.ones(len(indices), dtype=bool), indices, arrays['indptr']), 
+                                   shape=(nrows, ncols), copy=False)
+        return cls(arrays['keys'], matrix, arrays['gotermlist'])
+
+    @classmethod
+    def from_df(cls, df, keycol, gomatrix, gotermidx):
+        """
+        Build from annotation df with columns <keycol> and goterm, propagating each 
+        annotation through the ontology matrix in one sparse product.  
+        """
+        log = logging.getLogger(cls.__name__)
+        gotermlist = np.empty(len(gotermidx), dtype=object)
+        for (gt, idx) in gotermidx.items():
+            gotermlist[idx] = gt
+
+        df = df[df[keycol].notna()]
+        termcodes = df['goterm'].map(gotermidx)
+        missing = termcodes.isna()
+        if missing.any():
+            log.warning(f"{missing.sum()} annotations with goterms not in ontology. Dropping...")
+        df = df[~missing]
+        termcodes = termcodes[~missing].astype(np.int64).values
+        (rowcodes, keys) = pd.factorize(df[keycol])
+        
+        amatrix = sparse.csr_matrix((np.ones(len(rowcodes), dtype=np.int32), (rowcodes, termcodes)), 
+                                    shape=(len(keys), len(gotermlist)))
+        gmatrix = sparse.csr_matrix(gomatrix, dtype=np.int32)
+        pmatrix = amatrix @ gmatrix
+        pmatrix.sum_duplicates()
+        pmatrix.eliminate_zeros()
+        pmatrix.sort_indices()
+        log.debug(f"propagated {len(rowcodes)} annotations for {len(keys)} keys -> {pmatrix.nnz} entries")
+        return cls(np.asarray(keys, dtype=object), pmatrix, gotermlist)
 
 
 def build_uniprot_bypid(config):
@@ -275,54 +667,17 @@ def build_uniprot_bypid(config):
     Since this is only used by do_evaluate we will only use experimentally
     validated annotations. 
     
-    builds dictionary geneid -> propagated govector. 
+    builds index pid -> propagated govector. 
     
-    Returns dict for later use..
+    Returns GoVectorIndex for later use..
     """
     ontobj = get_ontology_object(config, usecache=True)
+    gomatrix = get_ontology_matrix(config, usecache=True)
     ubt = get_uniprot_byterm_df(config, usecache=True, exponly=True)
-    pids = list(ubt.pid.unique())
-    logging.debug(f"pid list, length={len(pids)} e.g. : {pids[:50]}")
-    ubtd = ubt.to_dict(orient = 'index')
-    logging.debug(f"converted DF to dict: e.g. \n{ [ubtd[i] for i in range(0,3)] } ")
-   
-    bypiddict = {}
-    sumreport = 1
-    suminterval = 10000
-    repthresh = sumreport * suminterval
-    gtlength = len(ontobj.gotermidx)
-    logging.debug(f"gv length is {gtlength}")
-    
-    i = 0
-    currentpid = None
-    currentgv = np.zeros(gtlength, dtype=bool)
-    while i < len(ubtd):
-        row = ubtd[i]
-        pid = row['pid']
-        #logging.debug(f"row {i} is pid {pid}")
-        if currentpid is None:
-            currentpid = pid
-            currentgv = currentgv + ontobj[row['goterm']]
-
-        elif currentpid == pid:
-            # same pid, continue...
-            currentgv = currentgv + ontobj[row['goterm']] 
-        else:
-            # new pid
-            bypiddict[currentpid] = currentgv 
-            currentpid = pid
-            currentgv = np.zeros(gtlength, dtype=bool)
-
-        if len(bypiddict) >= repthresh:
-            logging.info(f"Processed {len(bypiddict)} entries... ")
-            sumreport +=1
-            repthresh = sumreport * suminterval    
-        
-        i += 1
-        
-    samplekeys = list(bypiddict.keys())[:3]
-    logging.debug(f"Made dict by proteinid: {[ bypiddict[k] for k in samplekeys]} ")
-    return bypiddict
+    logging.debug(f"building index for {ubt.pid.nunique()} pids...")
+    gvi = GoVectorIndex.from_df(ubt, 'pid', gomatrix, ontobj.gotermidx)
+    logging.debug(f"Made index by proteinid: {gvi}")
+    return gvi
 
 
 def build_uniprot_bygene(config):
@@ -339,55 +694,45 @@ def build_uniprot_bygene(config):
 NOTES:  NaN expected for gene, omit...
         gene will not be unique. handle all...
     
-    builds dictionary gene -> propagated govector. 
+    builds index gene -> propagated govector. 
     
-    Returns dict for later use..
+    Returns GoVectorIndex for later use..
     """
     ontobj = get_ontology_object(config, usecache=True)
+    gomatrix = get_ontology_matrix(config, usecache=True)
     ubtdf = get_uniprot_byterm_df(config, usecache=True, exponly=False)
-    ubtdf = ubtdf[ubtdf.gene.notna()]
-    ubtdf.sort_values(by='gene', inplace=True)
-    ubtdf.reset_index(drop=True, inplace=True)
-        
-    ubtd = ubtdf.to_dict(orient = 'index')
-    logging.debug(f"converted DF to dict: e.g. \n{ [ubtd[i] for i in range(0,3)] } ")
-   
-    bygenedict = {}
-    sumreport = 1
-    suminterval = 10000
-    repthresh = sumreport * suminterval
-    gtlength = len(ontobj.gotermidx)
-    logging.debug(f"gv length is {gtlength}")
-    
-    i = 0
-    currentgid = None
-    currentgv = np.zeros(gtlength, dtype=bool)
-    while i < len(ubtd):
-        row = ubtd[i]
-        gid = row['gene']
-        #logging.debug(f"row {i} is pid {pid}")
-        if currentgid is None:
-            currentgid = gid
-            currentgv = currentgv + ontobj[row['goterm']]
-            
-        elif currentgid == gid:
-            # same gid, continue...
-            currentgv = currentgv + ontobj[row['goterm']] 
-        else:
-            # new gid
-            bygenedict[currentgid] = currentgv 
-            currentgid = gid
-            currentgv = np.zeros(gtlength, dtype=bool)
-
-        if len(bygenedict) >= repthresh:
-            logging.info(f"Processed {len(bygenedict)} entries... ")
-            sumreport +=1
-            repthresh = sumreport * suminterval    
-        i += 1
-        
-    samplekeys = list(bygenedict.keys())[:3]
-    logging.debug(f"Made dict by geneid: {[ (k, bygenedict[k]) for k in samplekeys]} ")
-    return bygenedict
+    gvi = GoVectorIndex.from_df(ubtdf, 'gene', gomatrix, ontobj.gotermidx)
+    logging.debug(f"Made index by geneid: {gvi}")
+    return gvi
+
+
+def get_uniprot_bygene_index(config, usecache=True):
+    cache = ArtifactCache(config)
+    return cache.get('uniprotbygene', build_uniprot_bygene, config, 
+                     ['uniprot','ontology'], usecache=usecache)
+
+
+def build_uniprot_bygene_truthdf(config):
+    """
+    Known (gene, goterm) pairs, for vectorized joins against predictions. 
+    
+              cgid      goterm
+    0          11K  GO:0008150
+    1          11K  GO:0030430
+    2        128UP  GO:0005525
+    
+    """
+    gvi = get_uniprot_bygene_index(config, usecache=True)
+    df = gvi.to_df(keyname='cgid')
+    logging.debug(f"made truth df with {len(df)} (gene, goterm) pairs:\n{df}")
+    return df
+
+
+def get_uniprot_bygene_truthdf(config, usecache=True):
+    cache = ArtifactCache(config)
+    return cache.get('uniprotbygenetruth', build_uniprot_bygene_truthdf, config, 
+                     ['uniprot','ontology'], usecache=usecache)
+
 
 def do_evaluate_auroc(config, predictdf, goaspect):
     """
@@ -413,44 +758,68 @@ def do_evaluate_auroc(config, predictdf, goaspect):
     """
     
     logging.debug(f"got predictdf:\n{predictdf}")
-    ubgo = get_uniprot_bygene_object(config, usecache=True)
-    ontobj = get_ontology_object(config, usecache=True)
-    logging.debug(f"got known uniprot and ontology object.")  
+    truthdf = get_uniprot_bygene_truthdf(config, usecache=True)
+    logging.debug(f"got known (cgid, goterm) truth set, length={len(truthdf)}")
     
-    outdf = pd.DataFrame(columns = ['cid','goterm','score','cgid','correct','pest','pauc'])
-
-    cidlist = list(predictdf.cid.unique())
-    logging.debug(f"cid list: {cidlist}")
-    for cid in cidlist:
-        cdf = predictdf[predictdf.cid == cid].copy()
-        # get gene id. 
-        cgid = cdf.cgid.unique()[0]
-        logging.debug(f"cgid is {cgid}")
-        #logging.debug(f"geneid for this target is is {cgid}")
-        cdf['correct'] = cdf.apply(is_correct_apply, axis=1)
-        cdf.reset_index(drop=True, inplace=True) 
-        logging.debug(f"cdf after assessment:\n{cdf.dtypes}\n{cdf}")
-        # Normalize all estimates from score to .01 - .99
-        cmax = cdf.score.max()
-        cmin = cdf.score.min()
-        cdf['pest'] = np.interp(cdf['score'], (cmin, cmax ), (.01,.99))
-        logging.debug(f"cdf after score normalization -> pest is:\n{cdf.dtypes}\n{cdf}")
-        try:                 
-            pauc = metrics.roc_auc_score(cdf['correct'], cdf['pest'])
-            logging.debug(f"pauc is {pauc}")
-        except ValueError:
-            pauc = .50
-        
-        cdf['pauc'] = pauc
-        logging.debug(f"cdf is:\n{cdf}")
-        outdf = outdf.append(cdf, ignore_index=True)
-    outdf['correct'] = outdf['correct'].astype(np.bool)
+    # label correctness with one membership test against the truth set.
+    outdf = predictdf.reset_index(drop=True)
+    truthidx = pd.MultiIndex.from_frame(truthdf[['cgid','goterm']])
+    outdf['correct'] = pd.MultiIndex.from_frame(outdf[['cgid','goterm']]).isin(truthidx)
+    
+    # keep cids contiguous, in order of first appearance. 
+    outdf['cidorder'] = pd.factorize(outdf['cid'])[0]
+    outdf.sort_values(by='cidorder', kind='stable', inplace=True)
+    outdf.reset_index(drop=True, inplace=True)
     
+    # Normalize all estimates from score to .01 - .99 within each cid
+    grouped = outdf.groupby('cid', sort=False)
+    cmin = grouped['score'].transform('min')
+    cmax = grouped['score'].transform('max')
+    crange = cmax - cmin
+    outdf['pest'] = np.where(crange > 0, 
+                             .01 + (outdf['score'] - cmin) / crange.where(crange > 0, 1) * .98, 
+                             .99)
+    logging.debug(f"outdf after score normalization -> pest is:\n{outdf.dtypes}\n{outdf}")
+    
+    outdf['rank'] = grouped['pest'].rank(method='average')
+    outdf['posrank'] = outdf['rank'].where(outdf['correct'], 0.0)
+    cstats = outdf.groupby('cid', sort=False).agg(npos=('correct','sum'),
+                                                  ntot=('correct','size'),
+                                                  possum=('posrank','sum'))
+    cstats['pauc'] = rank_auroc(cstats['npos'], cstats['ntot'], cstats['possum'])
+    outdf['pauc'] = outdf['cid'].map(cstats['pauc'])
+    outdf.drop(columns=['cidorder','rank','posrank'], inplace=True)
+    
+    collist = ['cid','goterm','score','cgid','correct','pest','pauc']
+    outdf = outdf[collist + [ c for c in outdf.columns if c not in collist ]]
     logging.debug(f"outdf before auc is:\n{outdf}")
-    auroc = metrics.roc_auc_score(outdf['correct'], outdf['pest'])
+    
+    ranks = outdf['pest'].rank(method='average')
+    auroc = rank_auroc(outdf['correct'].sum(), 
+                       len(outdf), 
+                       ranks[outdf['correct']].sum())
     outdf['auroc'] = auroc
     #f1scr = metrics.f1_score(outdf['correct'], outdf['pest']         )
     #outdf['f1score'] = f1scr
     logging.debug(f"outdf after auroc is:\n{outdf}")
     return outdf
 
+
+def rank_auroc(npos, ntot, possum):
+    """
+    Mann-Whitney form of ROC AUC from the sum of (tie-averaged) ranks of the positives:
+    
+        auc = (possum - npos * (npos + 1) / 2) / (npos * nneg)
+    
+    Works on scalars or aligned Series (one value per cid). Where AUC is undefined 
+    (all correct or none correct) returns .50, as the per-cid roc_auc_score path did.  
+    """
+    npos = np.asarray(npos, dtype=np.float64)
+    nneg = np.asarray(ntot, dtype=np.float64) - npos
+    denom = npos * nneg
+    with np.errstate(divide='ignore', invalid='ignore'):
+        auc = (np.asarray(possum, dtype=np.float64) - npos * (npos + 1) / 2) / denom
+    auc = np.where(denom > 0, auc, .50)
+    if auc.ndim == 0:
+        auc = float(auc)
+    return auc
@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+#
+#  phmmer output handling.
+#
+#  read_tblout():  streams HMMER --tblout / --domtblout into typed DataFrame chunks,
+#                  applying E-value and top-X cutoffs while parsing.
+#  HitTable:       phmmer hits indexed by (query, target) for pair lookups and joins.
+#
+#          cid    pdb     pacc          pid       eval  pscore  bias
+#  0    Q9QY40     sp   Q3UH93  Q3UH93_MOUSE  1.2e-150   502.1   3.2
+#
+#  run_phmmer_sharded():  splits query FASTA into residue-balanced shards and runs one 
+#                         phmmer per shard against a shared target DB, retrying failed 
+#                         shards, then merges the parsed tables.
+#
+#  phmmer.py parse <tblout> <outfile.parquet> [-e <eval>] [-x <topx>] [-D]
+#  phmmer.py run   <queryfasta> <database> <outfile.parquet> [-n <shards>] [-c <cpus>] [-w <workdir>]
+#
+
+import argparse
+import glob
+import logging
+import os
+import subprocess
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+gitpath=os.path.expanduser("~/git/cshl-work")
+sys.path.append(gitpath)
+
+from utils.fastatool import read_fasta, shard_fasta
+
+# Fields before free-text description, per HMMER user guide. 
+TBLOUT_FIELDS = ['target', 'tacc', 'query', 'qacc', 
+                 'eval', 'pscore', 'bias', 'dom_eval', 'dom_score', 'dom_bias',
+                 'exp', 'reg', 'clu', 'ov', 'env', 'dom', 'rep', 'inc']
+
+DOMTBLOUT_FIELDS = ['target', 'tacc', 'tlen', 'query', 'qacc', 'qlen', 
+                    'eval', 'pscore', 'bias', 'domnum', 'ndom', 'c_eval', 'i_eval', 
+                    'dom_score', 'dom_bias', 'hmm_from', 'hmm_to', 'ali_from', 'ali_to', 
+                    'env_from', 'env_to', 'acc']
+
+# Columns kept, with dtypes. E-values stay float64: phmmer routinely reports values 
+# like 1e-150, below float32 range. 
+TBLOUT_COLUMNS = { 'cid'       : 'category',
+                   'pdb'       : 'category',
+                   'pacc'      : 'category',
+                   'pid'       : 'category',
+                   'eval'      : np.float64,
+                   'pscore'    : np.float32,
+                   'bias'      : np.float32,
+                   'dom_eval'  : np.float64,
+                   'dom_score' : np.float32,
+                   'dom_bias'  : np.float32 }
+
+DOMTBLOUT_COLUMNS = { 'cid'       : 'category',
+                      'pdb'       : 'category',
+                      'pacc'      : 'category',
+                      'pid'       : 'category',
+                      'eval'      : np.float64,
+                      'pscore'    : np.float32,
+                      'bias'      : np.float32,
+                      'domnum'    : np.int16,
+                      'ndom'      : np.int16,
+                      'c_eval'    : np.float64,
+                      'i_eval'    : np.float64,
+                      'dom_score' : np.float32,
+                      'dom_bias'  : np.float32,
+                      'ali_from'  : np.int32,
+                      'ali_to'    : np.int32 }
+
+
+def split_target(target):
+    """
+    sp|Q3UH93|Q3UH93_MOUSE  ->  ('sp', 'Q3UH93', 'Q3UH93_MOUSE')
+    Q3UH93                  ->  ('', 'Q3UH93', '')
+    """
+    fields = target.split('|')
+    if len(fields) >= 3:
+        return (fields[0], fields[1], fields[2])
+    return ('', target, '')
+
+
+def get_table_format(domains):
+    if domains:
+        return (DOMTBLOUT_FIELDS, DOMTBLOUT_COLUMNS)
+    return (TBLOUT_FIELDS, TBLOUT_COLUMNS)
+
+
+def make_chunk(cols, columns):
+    df = pd.DataFrame(cols)
+    return df.astype(columns)[list(columns.keys())]
+
+
+def read_tblout(filename, domains=False, eval_threshold=None, topx_threshold=None, chunksize=100000):
+    """
+    Streams phmmer --tblout (or --domtblout if domains=True) output, yielding typed 
+    DataFrames of up to chunksize rows. 
+    
+    Hits with full-sequence E-value > eval_threshold are dropped. Only the first 
+    topx_threshold targets of each query are kept; phmmer reports targets for a 
+    query contiguously, best first, so this needs no sorting. For domtblout, all 
+    domain rows of a kept target are kept. 
+    """
+    (fields, columns) = get_table_format(domains)
+    nfields = len(fields)
+    fidx = { f : i for (i, f) in enumerate(fields) }
+    numeric = [ c for c in columns if c not in ('cid', 'pdb', 'pacc', 'pid') ]
+    
+    cols = { c : [] for c in columns }
+    lastquery = None
+    lasttarget = None
+    ntargets = 0
+    nlines = 0
+    nkept = 0
+    with open(os.path.expanduser(filename)) as f:
+        for line in f:
+            if line.startswith('#') or len(line.strip()) == 0:
+                continue
+            nlines += 1
+            row = line.split(None, nfields)
+            query = row[fidx['query']]
+            target = row[fidx['target']]
+            if query != lastquery:
+                lastquery = query
+                lasttarget = None
+                ntargets = 0
+            if target != lasttarget:
+                lasttarget = target
+                ntargets += 1
+            if topx_threshold is not None and ntargets > topx_threshold:
+                continue
+            evalue = float(row[fidx['eval']])
+            if eval_threshold is not None and evalue > eval_threshold:
+                continue
+            (pdb, pacc, pid) = split_target(target)
+            cols['cid'].append(query)
+            cols['pdb'].append(pdb)
+            cols['pacc'].append(pacc)
+            cols['pid'].append(pid)
+            for c in numeric:
+                cols[c].append(row[fidx[c]])
+            nkept += 1
+            if len(cols['cid']) >= chunksize:
+                yield make_chunk(cols, columns)
+                cols = { c : [] for c in columns }
+    if len(cols['cid']) > 0 or nkept == 0:
+        yield make_chunk(cols, columns)
+    logging.debug(f"kept {nkept} of {nlines} hits from {filename}")
+
+
+def concat_chunks(chunks, domains=False):
+    chunks = list(chunks)
+    if len(chunks) == 1:
+        return chunks[0]
+    if len(chunks) == 0:
+        return make_chunk({ c : [] for c in get_table_format(domains)[1] }, get_table_format(domains)[1])
+    df = pd.concat(chunks, ignore_index=True)
+    # concat of differing categoricals falls back to object.
+    catcols = [ c for (c, t) in get_table_format(domains)[1].items() if t == 'category' ]
+    return df.astype({ c : 'category' for c in catcols })
+
+
+def get_tblout_df(filename, domains=False, eval_threshold=None, topx_threshold=None):
+    """
+    Whole table as one typed DataFrame. 
+    """
+    return concat_chunks(read_tblout(filename, domains, eval_threshold, topx_threshold), domains)
+
+
+def get_arrow_schema(domains=False):
+    fieldlist = []
+    for (c, t) in get_table_format(domains)[1].items():
+        if t == 'category':
+            fieldlist.append(pa.field(c, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fieldlist.append(pa.field(c, pa.from_numpy_dtype(np.dtype(t))))
+    return pa.schema(fieldlist)
+
+
+def write_parquet(chunks, outfile, domains=False):
+    """
+    Writes DataFrame chunks to Parquet, one row group each. Returns number of rows.
+    """
+    schema = get_arrow_schema(domains)
+    nhits = 0
+    with pq.ParquetWriter(os.path.expanduser(outfile), schema) as pw:
+        for df in chunks:
+            pw.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            nhits += len(df)
+    return nhits
+
+
+def tblout_to_parquet(filename, outfile, domains=False, eval_threshold=None, topx_threshold=None,
+                      chunksize=100000):
+    """
+    Streams tblout into Parquet without holding the whole table. 
+    Returns number of hits written. 
+    """
+    nhits = write_parquet(read_tblout(filename, domains, eval_threshold, topx_threshold, chunksize),
+                          outfile, domains)
+    logging.info(f"wrote {nhits} hits from {filename} to {outfile}")
+    return nhits
+
+
+def load_hits(filename):
+    """
+    Hits DataFrame from Parquet, or from CSV as written by earlier runs. 
+    """
+    filename = os.path.expanduser(filename)
+    if filename.endswith('.parquet'):
+        return pd.read_parquet(filename)
+    return pd.read_csv(filename, index_col=0)
+
+
+def run_phmmer(queryfile, database, outfile, cpus=1, domains=False):
+    """
+    Runs one phmmer, table output only. Raises CalledProcessError on failure. 
+    """
+    tblopt = '--domtblout' if domains else '--tblout'
+    cmdlist = ['phmmer', tblopt, outfile, '--noali', '--cpu', str(cpus), 
+               '-o', os.devnull, queryfile, database]
+    logging.debug(f"command is {' '.join(cmdlist)}")
+    subprocess.run(cmdlist, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, 
+                   universal_newlines=True)
+    return outfile
+
+
+def get_shard_plan(nshards=None, cpus=None):
+    """
+    (nshards, cpus per shard). By default uses all cores, 2 per phmmer process, 
+    since a single phmmer gains little beyond a few worker threads. 
+    """
+    ncores = cpus if cpus is not None else os.cpu_count()
+    if nshards is None:
+        nshards = max(1, ncores // 2)
+    return (nshards, max(1, ncores // nshards))
+
+
+def run_phmmer_sharded(queryfile, database, workdir, outfile=None, nshards=None, cpus=None, 
+                       retries=2, domains=False, eval_threshold=None, topx_threshold=None):
+    """
+    Splits queryfile into nshards residue-balanced shards under workdir, runs them 
+    concurrently against database, and re-runs failed shards up to retries times. 
+    
+    Each query lands in exactly one shard, so per-query topx_threshold is unaffected. 
+    Tables are parsed shard by shard; with outfile they are streamed into one Parquet 
+    file and the hit count returned, otherwise the merged DataFrame is returned. 
+    Shards and tables of earlier runs in workdir are removed first. 
+    Raises RuntimeError if any shard still fails. 
+    """
+    workdir = os.path.abspath(os.path.expanduser(workdir))
+    database = os.path.expanduser(database)
+    (nshards, shardcpus) = get_shard_plan(nshards, cpus)
+    # an earlier run with more shards would leave extra shards and tables behind. 
+    for stale in glob.glob(f"{glob.escape(workdir)}/phmmer.*"):
+        logging.debug(f"removing stale {stale}")
+        os.remove(stale)
+    shardlist = shard_fasta(read_fasta(os.path.expanduser(queryfile)), workdir, nshards, 
+                            balance='residues', prefix='phmmer')
+    # small query sets leave some shards empty.
+    shardlist = [ sp for sp in shardlist if os.path.getsize(sp) > 0 ]
+    ext = 'domtbl' if domains else 'tbl'
+    tblmap = { sp : f"{os.path.splitext(sp)[0]}.{ext}.txt" for sp in shardlist }
+    logging.info(f"running {len(shardlist)} phmmer shards with --cpu {shardcpus} against {database}")
+
+    pending = list(shardlist)
+    attempt = 0
+    while len(pending) > 0 and attempt <= retries:
+        if attempt > 0:
+            logging.warning(f"retrying {len(pending)} failed shards, attempt {attempt} of {retries}")
+        failed = []
+        with ThreadPoolExecutor(max_workers=len(pending)) as ex:
+            futures = { sp : ex.submit(run_phmmer, sp, database, tblmap[sp], shardcpus, domains) 
+                        for sp in pending }
+            for sp in pending:
+                try:
+                    futures[sp].result()
+                    logging.debug(f"finished shard {sp}")
+                except subprocess.CalledProcessError as cpe:
+                    logging.error(f"phmmer failed on {sp} rc={cpe.returncode}: {cpe.stderr}")
+                    failed.append(sp)
+        pending = failed
+        attempt += 1
+    if len(pending) > 0:
+        raise RuntimeError(f"phmmer failed on {len(pending)} shards after {retries} retries: {pending}")
+
+    chunks = ( df for sp in shardlist 
+               for df in read_tblout(tblmap[sp], domains, eval_threshold, topx_threshold) )
+    if outfile is not None:
+        nhits = write_parquet(chunks, outfile, domains)
+        logging.info(f"wrote {nhits} hits from {len(shardlist)} shards to {outfile}")
+        return nhits
+    return concat_chunks(chunks, domains)
+
+
+class HitTable(object):
+    """
+    Hits DataFrame indexed by sorted (query, target) MultiIndex.
+
+    ht = HitTable(df)
+    ht.get('Q9QY40', 'Q3UH93')          -> DataFrame of matching hit rows
+    ht.match_pairs([(q, t), ...])       -> one vectorized join for all pairs,
+                                           with nmatch multiplicity per pair
+    """
+
+    def __init__(self, df, querycol='cid', targetcol='pacc'):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.querycol = querycol
+        self.targetcol = targetcol
+        self.df = df.set_index([querycol, targetcol]).sort_index()
+        self.log.debug(f"indexed {len(self.df)} hits.")
+
+    def __repr__(self):
+        return f"HitTable: {len(self.df)} hits"
+
+    def __len__(self):
+        return len(self.df)
+
+    def __contains__(self, pair):
+        return pair in self.df.index
+
+    def get(self, query, target):
+        """
+        All hit rows for (query, target). Empty DataFrame if none.
+        """
+        try:
+            rows = self.df.loc[[(query, target)]]
+        except KeyError:
+            rows = self.df.iloc[0:0]
+        return rows.reset_index()
+
+    def match_pairs(self, pairs, querycol='query', targetcol='target'):
+        """
+        Joins list of (query, target) pairs against hits in one merge.
+        Returns DataFrame with one row per (pair, hit), pairs with no hit included with
+        NaN hit columns, in pairs order, plus nmatch = number of hits for that pair.
+        """
+        pdf = pd.DataFrame(list(pairs), columns=[querycol, targetcol])
+        pdf['pairnum'] = range(len(pdf))
+        hits = self.df.reset_index().rename(columns={ self.querycol : querycol,
+                                                      self.targetcol : targetcol })
+        counts = hits.groupby([querycol, targetcol], observed=True).size().rename('nmatch').reset_index()
+        mdf = pdf.merge(counts, on=[querycol, targetcol], how='left')
+        mdf['nmatch'] = mdf['nmatch'].fillna(0).astype(int)
+        mdf = mdf.merge(hits, on=[querycol, targetcol], how='left')
+        mdf = mdf.sort_values('pairnum', kind='stable').drop(columns='pairnum').reset_index(drop=True)
+        return mdf
+
+
+if __name__ == '__main__':
+    FORMAT='%(asctime)s (UTC) [ %(levelname)s ] %(filename)s:%(lineno)d %(name)s.%(funcName)s(): %(message)s'
+    logging.basicConfig(format=FORMAT)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-d', '--debug',
+                        action="store_true",
+                        dest='debug',
+                        help='debug logging')
+
+    parser.add_argument('-v', '--verbose',
+                        action="store_true",
+                        dest='verbose',
+                        help='verbose logging')
+
+    parser.add_argument('-D', '--domtblout',
+                        action="store_true",
+                        dest='domains',
+                        help='input is --domtblout')
+
+    parser.add_argument('-e', '--eval_threshold',
+                        action="store",
+                        dest='eval_threshold',
+                        type=float,
+                        default=None,
+                        help='drop hits with E-value above this')
+
+    parser.add_argument('-x', '--topx_threshold',
+                        action="store",
+                        dest='topx_threshold',
+                        type=int,
+                        default=None,
+                        help='keep only top X targets per query')
+
+    parser.add_argument('-n', '--nshards',
+                        action="store",
+                        dest='nshards',
+                        type=int,
+                        default=None,
+                        help='run: number of concurrent phmmer shards [cores / 2]')
+
+    parser.add_argument('-c', '--cpus',
+                        action="store",
+                        dest='cpus',
+                        type=int,
+                        default=None,
+                        help='run: total cores to use [all]')
+
+    parser.add_argument('-w', '--workdir',
+                        action="store",
+                        dest='workdir',
+                        default='~/work/phmmer',
+                        help='run: shard workdir [~/work/phmmer]')
+
+    parser.add_argument('command',
+                        metavar='command',
+                        type=str,
+                        choices=['parse', 'run'],
+                        help='parse <tblout> <outfile> | run <queryfasta> <database> <outfile>')
+
+    parser.add_argument('paths',
+                        metavar='paths',
+                        type=str,
+                        nargs='+',
+                        help='input and output paths')
+
+    args= parser.parse_args()
+
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    if args.command == 'parse':
+        tblout_to_parquet(args.paths[0], args.paths[1], domains=args.domains,
+                          eval_threshold=args.eval_threshold, topx_threshold=args.topx_threshold)
+    elif args.command == 'run':
+        run_phmmer_sharded(args.paths[0], args.paths[1], args.workdir, outfile=args.paths[2],
+                           nshards=args.nshards, cpus=args.cpus, domains=args.domains,
+                           eval_threshold=args.eval_threshold, topx_threshold=args.topx_threshold)
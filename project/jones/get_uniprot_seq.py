@@ -8,12 +8,28 @@
 #    MOUSE    Mus musculus    Mouse    mouse    10090
 #    RAT    Rattus norvegicus    Rat    rat    10116
 #
+#   Organisms are fetched concurrently over one pooled session. Each response is
+#   streamed to <short>_sequences.<format>.part and renamed when complete, so an
+#   interrupted download resumes from the partial file with a Range request.
+#
+#   get_uniprot_seq.py [-n 4] [-o <outdir>] [-b <baseurl>] <idtable>
 #
 import argparse
 import logging
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
 import pandas as pd
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BASEURL = "https://www.uniprot.org/uniprot/"
+CHUNKSIZE = 1048576
+
 def read_idfile(infile):
     idlist = []
     f = open(infile, 'r')
@@ -33,15 +49,128 @@ def read_idtable(infile):
     return tlist
 
 
-def down_seq(orgid, shortname, format='fasta' ):
-    logging.debug(f"getting sequences for id {orgid} ... ")
-    url = f"https://www.uniprot.org/uniprot/?query=organism:{orgid}&format={format}&compress=no"
-    r = requests.get(url, allow_redirects=True)
-    #print(r.content)
-    logging.debug(f"writing to file {shortname}_sequences.{format} ")
-    f = open(f'{shortname}_sequences.{format}','wb')
-    f.write(r.content)
-    f.close()
+def make_session(nconn=4):
+    """
+    Session with connection pool sized for nconn concurrent downloads, retrying 
+    connection errors and transient server errors with backoff. 
+    """
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=nconn, pool_maxsize=nconn, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_expected_size(r, offset):
+    """
+    Total file size from response headers, or None if not given (chunked).
+    """
+    crange = r.headers.get('Content-Range')
+    if crange is not None and '/' in crange:
+        total = crange.split('/')[-1]
+        if total.isdigit():
+            return int(total)
+    clen = r.headers.get('Content-Length')
+    if clen is not None and clen.isdigit():
+        return offset + int(clen)
+    return None
+
+
+def check_download(partfile, format):
+    """
+    Without a Content-Length, at least check FASTA is whole records. 
+    """
+    size = os.path.getsize(partfile)
+    if format != 'fasta' or size == 0:
+        return True
+    with open(partfile, 'rb') as f:
+        first = f.read(1)
+        f.seek(size - 1)
+        last = f.read(1)
+    return first == b'>' and last == b'\n'
+
+
+def down_seq(orgid, shortname, format='fasta', session=None, baseurl=BASEURL, outdir='.', 
+             retries=3, timeout=300):
+    """
+    Streams one organism's sequences to <outdir>/<short>_sequences.<format>. 
+    Skips if already complete, resumes a .part file if present. 
+    Returns (orgid, outfile, nbytes). Raises IOError if download can't be completed. 
+    """
+    if session is None:
+        session = make_session(1)
+    outfile = f"{outdir}/{shortname}_sequences.{format}"
+    partfile = f"{outfile}.part"
+    if os.path.exists(outfile):
+        logging.debug(f"{outfile} already complete, skipping.")
+        return (orgid, outfile, os.path.getsize(outfile))
+    url = f"{baseurl}?query=organism:{orgid}&format={format}&compress=no"
+
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(partfile) if os.path.exists(partfile) else 0
+        # identity, so Content-Length and Range offsets count the bytes written to disk.
+        headers = { 'Accept-Encoding' : 'identity' }
+        if offset > 0:
+            headers['Range'] = f"bytes={offset}-"
+        logging.debug(f"getting sequences for id {orgid} from byte {offset} ... ")
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout, 
+                             allow_redirects=True) as r:
+                if r.status_code == 416:
+                    # nothing past offset. part file may be whole, or stale. restart.
+                    os.remove(partfile)
+                    continue
+                r.raise_for_status()
+                if offset > 0 and r.status_code != 206:
+                    logging.debug(f"server ignored Range for {orgid}, restarting.")
+                    offset = 0
+                encoded = r.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+                if encoded and offset > 0:
+                    # encoded range can't be appended to decoded part file. restart whole.
+                    logging.debug(f"server encoded ranged response for {orgid}, restarting.")
+                    os.remove(partfile)
+                    continue
+                # for encoded bodies header sizes count encoded bytes, so can't be checked.
+                expected = None if encoded else get_expected_size(r, offset)
+                mode = 'ab' if offset > 0 else 'wb'
+                with open(partfile, mode) as f:
+                    for chunk in r.iter_content(chunk_size=CHUNKSIZE):
+                        f.write(chunk)
+            size = os.path.getsize(partfile)
+            if expected is not None and size != expected:
+                raise IOError(f"got {size} of {expected} bytes")
+            if not check_download(partfile, format):
+                raise IOError(f"incomplete {format} in {partfile}")
+            os.replace(partfile, outfile)
+            logging.debug(f"wrote {size} bytes to file {outfile} ")
+            return (orgid, outfile, size)
+        except (requests.RequestException, IOError) as e:
+            logging.warning(f"download of {orgid} failed, attempt {attempt + 1}: {e}")
+            time.sleep(min(2 ** attempt, 30))
+    raise IOError(f"could not download {orgid} to {outfile}")
+
+
+def down_all(tlist, format='fasta', nconn=4, baseurl=BASEURL, outdir='.'):
+    """
+    Downloads (orgid, shortname) list, nconn at a time. 
+    Returns list of (orgid, outfile, nbytes) for successes. Failures are logged. 
+    """
+    os.makedirs(outdir, exist_ok=True)
+    session = make_session(nconn)
+    donelist = []
+    with ThreadPoolExecutor(max_workers=nconn) as ex:
+        futures = { ex.submit(down_seq, orgid, short, format, session, baseurl, outdir) : orgid 
+                    for (orgid, short) in tlist }
+        for fu in as_completed(futures):
+            try:
+                donelist.append(fu.result())
+            except IOError as e:
+                logging.error(f"{futures[fu]}: {e}")
+    logging.info(f"downloaded {len(donelist)} of {len(tlist)} organisms.")
+    session.close()
+    return donelist
 
 
 if __name__ == '__main__':
@@ -59,6 +188,25 @@ if __name__ == '__main__':
                         dest='verbose', 
                         help='verbose logging')
 
+    parser.add_argument('-n', '--nconn', 
+                        action="store", 
+                        dest='nconn', 
+                        type=int,
+                        default=4,
+                        help='concurrent downloads [4]')
+
+    parser.add_argument('-o', '--outdir', 
+                        action="store", 
+                        dest='outdir', 
+                        default='.',
+                        help='output directory [.]')
+
+    parser.add_argument('-b', '--baseurl', 
+                        action="store", 
+                        dest='baseurl', 
+                        default=BASEURL,
+                        help=f'UniProt query URL [{BASEURL}]')
+
     parser.add_argument('infile', 
                         metavar='infile', 
                         type=str, 
@@ -72,6 +220,5 @@ if __name__ == '__main__':
         logging.getLogger().setLevel(logging.INFO)
     
     tlist = read_idtable(args.infile)
-    for (id, short) in tlist:
-        down_seq(id, short)
+    down_all(tlist, nconn=args.nconn, baseurl=args.baseurl, outdir=args.outdir)
     
@@ -13,54 +13,36 @@
 
 import argparse
 import logging
+import os
+import sys
+import traceback
+
+gitpath=os.path.expanduser("~/git/cshl-work")
+sys.path.append(gitpath)
 
 import pandas as pd
 import h5py
 
+from utils.fastatool import FastaWriter, read_fasta
+from utils.seqdb import get_sequence_source
+
 def parse_tfa_file(infile):
     """
     Reads .tfa file, determines species, target ids, geneids. 
     
-    returns dataframe:
-    pacc pid sequence
+    returns dict:
+    pacc -> sequence
     
     """
-    listoflists = []
+    map = {}
     try:
-        f = open(infile, 'r')
-        currentheader = None
-        currentseq = None
-                
-        for line in f:
+        for rec in read_fasta(infile):
             #  tr|B5X0T5|B5X0T5_SALSA Glutamate dehydrogenase OS=Salmo salar OX=8030 GN=DHE3 PE=2 SV=1
-            if line.startswith(">"):
-                # new entry, deal with old:
-                if currentseq is not None:
-                    logging.debug(f"header: {currentheader}")
-                    logging.debug(f"sequence: {currentseq}")
-                    currentheader.append(currentseq)
-                    listoflists.append(currentheader)
-                    currentseq = None
-                # start new entry
-                currentheader = line[1:].split()
-                currentheader = currentheader[0].split('|')[1:]
-            else:
-                line = line.strip()
-                if currentseq is not None:
-                    currentseq = f"{currentseq}{line}"
-                else:
-                    currentseq = line
+            map[rec.accession] = rec.sequence
     except FileNotFoundError:
         logging.error(f"file not readable {infile} ")
         
-    logging.info(f"got {len(listoflists)} entries...")
-    logging.debug(f"listoflists: {listoflists}") 
-    df = pd.DataFrame(listoflists, columns=['pacc','pid','sequence'])
-    #df = pd.DataFrame(priormatrix, index=ontobj.gotermlist, columns=['score'])
-    #df.set_index('pacc', inplace=True)
-    map = pd.Series(df.sequence.values, index=df.pacc).to_dict()
-    
-    #logging.debug(f"dimension:  {df.shape}")
+    logging.info(f"got {len(map)} entries...")
     return map
 
 
@@ -123,24 +105,12 @@ def write_tfa_file(outlist, seqmap, outfile):
     '''
     outlist is tuple: ( netid, uid )
     '''
-    
-    s=""
-    x = 60
-    nummissing = 0
-    numfound = 0
-    
-    for (netid, uid ) in outlist:    
-        try:
-            sequence = seqmap[uid]
-            numfound += 1
-            s += f">{netid} {uid}\n"
-            chunklist = [ sequence[y-x:y] for y in range(x, len(sequence)+x, x) ] 
-            #logging.debug(f"chunklist {chunklist}")
-            for c in chunklist:
-                s += f"{c}\n"
-        except KeyError:
+    foundlist = [ (netid, uid) for (netid, uid) in outlist if uid in seqmap ]
+    numfound = len(foundlist)
+    nummissing = len(outlist) - numfound
+    for (netid, uid) in outlist:
+        if uid not in seqmap:
             logging.warning(f"no sequence found for uid {uid} !")
-            nummissing += 1
     
     if nummissing > 10:
         logging.warning(f"{nummissing} sequences missing from DB!")
@@ -148,14 +118,13 @@ def write_tfa_file(outlist, seqmap, outfile):
     
     if numfound > 1:    
         try:
-            f = open(outfile, 'w')
-            f.write(s)
+            with FastaWriter(outfile) as fw:
+                for (netid, uid) in foundlist:
+                    fw.write(f"{netid} {uid}", seqmap[uid])
             logging.info(f"Wrote TFA sequence to file {outfile}")
         except IOError:
             logging.error(f"could not write to file {outfile}")
             traceback.print_exc(file=sys.stdout) 
-        finally:
-            f.close()
     else:
         logging.error("No sequences found.")
 
@@ -189,7 +158,7 @@ if __name__ == '__main__':
     parser.add_argument('fastafile', 
                         metavar='fastafile', 
                         type=str, 
-                        help='uniprot fasta file')
+                        help='uniprot fasta file, or seqdb.py sequence db directory')
 
     parser.add_argument('outfile', 
                         metavar='outfile', 
@@ -215,7 +184,8 @@ if __name__ == '__main__':
     outlist = make_uidlist(list(edf.columns), mapdict)
     logging.debug(f"got outlist = {outlist}")
     
-    smap = parse_tfa_file(args.fastafile)
+    seqsource = get_sequence_source(args.fastafile)
+    smap = seqsource.fetch_many([ uid for (netid, uid) in outlist ])
     logging.debug(f"got smap={smap}")
     
     write_tfa_file(outlist, smap, args.outfile)
@@ -7,14 +7,19 @@
 import os
 import sys
 import logging
+import traceback
 
 gitpath=os.path.expanduser("~/git/cafa4")
 sys.path.append(gitpath)
+gitpath=os.path.expanduser("~/git/cshl-work")
+sys.path.append(gitpath)
 
 print("salmon!")
 
 import pandas as pd
 
+from utils.fastatool import FastaIndex, FastaWriter, read_fasta
+
 #unisalmon='/Users/jhover/play/jones/small-uniprot-trembl-salmon.8030.fasta'
 unisalmon='/Users/jhover/play/jones/uniprot-trembl-salmon.8030.fasta'
 salmonhi='/Users/jhover/play/jones/salmon_hipriority_uniprotIDs.tsv'
@@ -31,37 +36,14 @@ def parse_tfa_file(infile):
     """
     listoflists = []
     try:
-        f = open(infile, 'r')
-        currentheader = None
-        currentseq = None
-                
-        for line in f:
+        for rec in read_fasta(infile):
             #  tr|B5X0T5|B5X0T5_SALSA Glutamate dehydrogenase OS=Salmo salar OX=8030 GN=DHE3 PE=2 SV=1
-            if line.startswith(">"):
-                # new entry, deal with old:
-                if currentseq is not None:
-                    logging.debug(f"header: {currentheader}")
-                    logging.debug(f"sequence: {currentseq}")
-                    currentheader.append(currentseq)
-                    listoflists.append(currentheader)
-                    currentseq = None
-                # start new entry
-                currentheader = line[1:].split()
-                currentheader = currentheader[0].split('|')[1:]
-            else:
-                line = line.strip()
-                if currentseq is not None:
-                    currentseq = f"{currentseq}{line}"
-                else:
-                    currentseq = line
+            listoflists.append([rec.accession, rec.pid, rec.sequence])
     except FileNotFoundError:
         logging.error(f"file not readable {infile} ")
         
     logging.debug(f"got {len(listoflists)} entries...")
-    logging.debug(f"listoflists: {listoflists}") 
     df = pd.DataFrame(listoflists, columns=['pacc','pid','sequence'])
-    #df = pd.DataFrame(priormatrix, index=ontobj.gotermlist, columns=['score'])
-    #df.set_index('pacc', inplace=True)
     logging.debug(f"dimension:  {df.shape}")
     return df
     
@@ -72,30 +54,18 @@ def read_species(infile):
     return sdf
     
 def write_tfa_file(df, outfile):
-    s=""
     snum = 1
     header="G8030"
-    x = 60
-    
-    for index, row in df.iterrows():
-       
-        s += f">G8030{snum:08} {row.pid}\n"
-        chunklist = [ row.sequence[y-x:y] for y in range(x, len(row.sequence)+x, x) ] 
-        #logging.debug(f"chunklist {chunklist}")
-        for c in chunklist:
-            s += f"{c}\n"
-        snum += 1
-    logging.debug(s)   
     
     try:
-        f = open(outfile, 'w')
-        f.write(s)
+        with FastaWriter(outfile) as fw:
+            for row in df.itertuples():
+                fw.write(f"{header}{snum:08} {row.pid}", row.sequence)
+                snum += 1
         logging.debug(f"Wrote TFA sequence to file {outfile}")
     except IOError:
         logging.error(f"could not write to file {outfile}")
         traceback.print_exc(file=sys.stdout) 
-    finally:
-        f.close()
             
 
 if __name__ == '__main__':
@@ -104,15 +74,14 @@ if __name__ == '__main__':
     logging.getLogger().setLevel(logging.INFO)
     #logging.getLogger().setLevel(logging.DEBUG)
     
-    tdf = parse_tfa_file(unisalmon)
-    print(f"{tdf}\n")
-    
     sdf = read_species(infile=salmonhi)
     print(sdf)
-    #newdf = 
     
-    # merge dataframes joining on pid == name
-    mdf = sdf.merge(tdf, how='inner',on=['pid'])
+    # fetch only the hi-priority sequences, by pid == name
+    fidx = FastaIndex(unisalmon)
+    seqmap = fidx.fetch_many(list(sdf.pid), key='pid')
+    mdf = sdf[sdf.pid.isin(seqmap.keys())].copy()
+    mdf['sequence'] = mdf.pid.map(seqmap)
     print(f"{mdf}\n")
 
     write_tfa_file(mdf, sequencefile)
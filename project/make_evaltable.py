@@ -6,10 +6,13 @@ import traceback
 
 gitpath=os.path.expanduser("~/git/cafa4")
 sys.path.append(gitpath)
+gitpath=os.path.expanduser("~/git/cshl-work")
+sys.path.append(gitpath)
 
 from fastcafa.fastcafa import *
+from phmmer.phmmer import HitTable, load_hits
 
-phmmerdf = os.path.expanduser("~/play/hamsini/dupe_targets_phmmer_20200926.csv")
+phmmerdf = os.path.expanduser("~/play/hamsini/dupe_targets_phmmer_20200926.parquet")
 dupepairs = os.path.expanduser("~/play/hamsini/mouse_dup_pairs_uniprot.txt")
 evaltable = os.path.expanduser("~/play/hamsini/mouse_dupe_scores.csv")
 
@@ -26,10 +29,9 @@ def parse_dupepairs():
     logging.debug(f"dupelist[1] = {dupelist[1]}")
     return dupelist
 
-def get_match(query, target, df):
+def get_match(query, target, hittable):
     logging.debug(f"query={query} target={target}")
-    qdf = df[df.cid == query]
-    row = qdf[qdf.pacc == target]
+    row = hittable.get(query, target)
     if len(row) > 1 :
         logging.warning(f'multiple matches for query={query} target={target} ')
         return None
@@ -44,6 +46,21 @@ def get_match(query, target, df):
         return None
 
 
+def get_matches(dupelist, hittable):
+    """
+    Resolves all dupe pairs against hit table in one join. 
+    Pairs with zero or multiple hits are reported and dropped, as get_match() does. 
+    """
+    mdf = hittable.match_pairs(dupelist)
+    for r in mdf[mdf.nmatch == 0].itertuples():
+        logging.warning(f'no matches for query={r.query} target={r.target} ')    
+    multi = mdf[mdf.nmatch > 1].drop_duplicates(subset=['query','target'])
+    for r in multi.itertuples():
+        logging.warning(f'multiple ({r.nmatch}) matches for query={r.query} target={r.target} ')
+    edf = mdf[mdf.nmatch == 1][['query','target','eval','pscore','bias']].reset_index(drop=True)
+    return edf
+
+
 if __name__ == '__main__':
     FORMAT='%(asctime)s (UTC) [ %(levelname)s ] %(filename)s:%(lineno)d %(name)s.%(funcName)s(): %(message)s'
     logging.basicConfig(format=FORMAT)
@@ -52,29 +69,15 @@ if __name__ == '__main__':
     logging.debug("make evaltable...")
     config = get_default_config()
 
-    pdf  = pd.read_csv(phmmerdf, index_col=0)
+    pdf  = load_hits(phmmerdf)
     pdf.drop_duplicates(inplace=True,ignore_index=True)
     
     dupelist = parse_dupepairs()
     
-    lod = []
-        
-    for tup in dupelist:
-        (p1, p2) = tup
-        logging.debug(f"looking for {p1} -> {p2}")
-        rv = get_match(p1, p2, pdf)
-        if rv is not None:
-            (eval, pscore, bias ) = rv
-            lod.append( { 'query' : p1,
-                          'target' : p2,
-                          'eval' : eval,
-                          'pscore' : pscore,
-                          'bias' : bias,  
-                            }
-            )
+    hittable = HitTable(pdf)
+    edf = get_matches(dupelist, hittable)
     logging.debug(f"dupelist length: {len(dupelist)}")
-    logging.debug(f"matchlist length: {len(lod)}")
-    edf = pd.DataFrame(lod)
+    logging.debug(f"matchlist length: {len(edf)}")
     edf.to_csv(evaltable)
     logging.debug(f"wrote match df to {evaltable}")
 
@@ -3,7 +3,15 @@ import argparse
 import logging
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
+import pyarrow as pa
+
+gitpath=os.path.expanduser("~/git/cshl-work")
+sys.path.append(gitpath)
+
+from utils.fastatool import get_record_ranges, read_range_lines
 
 '''
   Take in trembl   fasta file and create Pandas-compatible tsv of accession, uniprotid, genename
@@ -42,6 +50,52 @@ def parse_uniprot_fasta(filename):
      
     df = pd.DataFrame(lod) 
     return df
+
+
+def parse_header_range(args):
+    '''
+    Worker: parse headers in one record-aligned byte range into an Arrow record batch.
+    '''
+    (filename, start, end) = args
+    dbs = []
+    accs = []
+    uids = []
+    gns = []
+    for line in read_range_lines(filename, start, end):
+        if line.startswith(b'>'):
+            fields = line.decode().split()
+            (db, acc, uid) = fields[0][1:].split('|')
+            gn = None
+            for t in fields[1:]:
+                if t.startswith('GN='):
+                    gn = t[3:]
+            dbs.append(db)
+            accs.append(acc)
+            uids.append(uid)
+            gns.append(gn)
+    batch = pa.record_batch([ pa.array(dbs, type=pa.string()), 
+                              pa.array(accs, type=pa.string()), 
+                              pa.array(uids, type=pa.string()), 
+                              pa.array(gns, type=pa.string()) ],
+                            names=['db','acc','uid','gn'])
+    return batch
+
+
+def parse_uniprot_fasta_parallel(filename, nprocs):
+    '''
+    Splits file into byte ranges on record starts, parses ranges in nprocs worker 
+    processes into Arrow record batches, and concatenates them in file order. 
+    Same columns as parse_uniprot_fasta(). 
+    '''
+    ranges = get_record_ranges(filename, nprocs * 4)
+    logging.info(f"parsing {filename} in {len(ranges)} ranges with {nprocs} processes...")
+    arglist = [ (filename, start, end) for (start, end) in ranges ]
+    with ProcessPoolExecutor(max_workers=nprocs) as executor:
+        batches = list(executor.map(parse_header_range, arglist))
+    table = pa.Table.from_batches(batches)
+    logging.info(f"Processed {table.num_rows} records. Done.")
+    df = table.to_pandas()
+    return df
            
     
 
@@ -52,6 +106,13 @@ if __name__ == '__main__':
     logging.getLogger().setLevel(logging.DEBUG)
     
     parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nprocs', 
+                        action="store", 
+                        dest='nprocs', 
+                        type=int,
+                        default=1,
+                        help='parse in parallel with N processes [1]')
+
     parser.add_argument('infile', 
                                metavar='infile', 
                                type=str, 
@@ -65,7 +126,10 @@ if __name__ == '__main__':
     args= parser.parse_args()
     
     logging.debug(f"infile={args.infile} outfile={args.outfile}")
-    tdf = parse_uniprot_fasta(args.infile)
+    if args.nprocs > 1:
+        tdf = parse_uniprot_fasta_parallel(args.infile, args.nprocs)
+    else:
+        tdf = parse_uniprot_fasta(args.infile)
     logging.debug(f"tdf=\n{tdf}")
     tdf.to_csv(args.outfile, sep='\t' )
     logging.debug(f"Wrote to {args.outfile}")
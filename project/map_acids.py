@@ -15,43 +15,42 @@ import subprocess
 gitpath=os.path.expanduser("~/git/cshl-work")
 sys.path.append(gitpath)
 
+from utils.uniprotdat import UniprotDatIndex
+
 DATFILE=os.path.expanduser('~/data/uniprot/humandb/uniprot_all_human.dat')
 
 
 def parse_uniprot_dat(filename):
-    filehandle = open(filename, 'r')
-    current = None
-    allentries = []
-    try:
-        while True:
-            line = filehandle.readline()
-            if line == '':
-                break
-
-            if line.startswith("ID "):
-                # ID   001R_FRG3G              Reviewed;         256 AA.
-                #      <prot_name>_<prot_spec>
-                proteinid = line[5:16].strip()
-                current = defaultdict(dict)
-                current['id'] = proteinid
-        
-            elif line.startswith("AC "):
-                # AC   Q6GZX4;
-                # AC   A0A023GPJ0; 
-                # AC   Q91896; O57469;
-                #logging.debug("Handling AC.")
-                rest = line[5:]
-                accession = rest.split(';')[0]
-                #accession = line[5:11].strip()
-                current['ac'] = accession
-
-         
-            elif line.startswith("//"):           
-                allentries.append(current)
-                current = None
-    except:
-        pass
-
+    """
+    Returns persistent accession index for .dat file, building it on first use. 
+    """
+    udi = UniprotDatIndex(filename)
+    logging.info(f"got index {udi}")
+    return udi
+
+
+def do_mappings(infile, outfile, datfile=DATFILE):
+    """
+    Maps each accession in infile (one per line, primary or secondary) to 
+    primary accession, ID and gene name. 
+    
+    <acc>  <primary acc>  <id>  <gene>
+    """
+    with open(infile) as f:
+        acclist = [ line.strip() for line in f if len(line.strip()) > 0 ]
+    udi = parse_uniprot_dat(datfile)
+    rows = udi.query_accessions(acclist, 'e.acc, e.id, e.gn')
+    bymap = { r[0] : r[1:] for r in rows }
+    nmissing = 0
+    with open(outfile, 'w') as of:
+        for acc in acclist:
+            try:
+                (primary, pid, gn) = bymap[acc]
+                of.write(f"{acc}\t{primary}\t{pid}\t{gn}\n")
+            except KeyError:
+                nmissing += 1
+                of.write(f"{acc}\tNA\tNA\tNA\n")
+    logging.info(f"mapped {len(acclist) - nmissing} of {len(acclist)} accessions to {outfile}")
 
 
 def do_water(infile, outfile):
@@ -78,12 +77,18 @@ if __name__ == '__main__':
     parser.add_argument('infile', 
                         metavar='infile', 
                         type=str, 
-                        help='a .fasta sequence file')
+                        help='file of UniProt accessions, one per line')
 
     parser.add_argument('outfile', 
                         metavar='outile', 
                         type=str, 
-                        help='pairwise info. <p1> <p2> <len> <dist>')
+                        help='mappings. <acc> <primary acc> <id> <gene>')
+
+    parser.add_argument('-u', '--datfile', 
+                        action="store", 
+                        dest='datfile', 
+                        default=DATFILE,
+                        help=f'UniProt .dat file [{DATFILE}]')
     
     args= parser.parse_args()
 
@@ -93,4 +98,4 @@ if __name__ == '__main__':
     if args.verbose:
         logging.getLogger().setLevel(logging.INFO)
     
-    do_mappings(args.infile, args.outfile)
\ No newline at end of file
+    do_mappings(args.infile, args.outfile, args.datfile)
\ No newline at end of file
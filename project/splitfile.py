@@ -1,49 +1,87 @@
 #!/usr/bin/env python
 #
-#  Split file by lines into N pieces.
-#  splitfile.py  <file> <N>
+#  Split file by lines into N pieces of roughly equal size, in bytes.
+#  With -f, split only at FASTA record starts. 
+#  splitfile.py [-f] <file> <N>
 
 import argparse
 import os
 import sys
 import logging
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 gitpath=os.path.expanduser("~/git/cshl-work")
 sys.path.append(gitpath)
 
-def file_len(filename):
-    i = -1
-    with open(filename) as f:
-        for i, l in enumerate(f):
-            pass
-    f.close()
-    return i + 1
+from utils.fastatool import find_record_start
 
-#
-#  i=0  line
-#  i=1 
-#
-def do_split(filename, nfiles):
+def find_line_start(filehandle, offset, blocksize=1048576):
+    """
+    Offset of first line start at or after offset, or file size. 
+    """
+    if offset <= 0:
+        return 0
+    filehandle.seek(offset - 1)
+    pos = offset - 1
+    while True:
+        block = filehandle.read(blocksize)
+        if len(block) == 0:
+            return pos
+        i = block.find(b'\n')
+        if i >= 0:
+            return pos + i + 1
+        pos += len(block)
+
+
+def get_split_offsets(filename, nfiles, fasta=False):
+    """
+    Returns nfiles + 1 byte offsets. Piece i is [offsets[i], offsets[i+1]). 
+    Each offset is size*i/nfiles snapped forward to next line start, or next 
+    FASTA record start if fasta=True. Pieces may be empty if file is tiny. 
+    """
+    size = os.path.getsize(filename)
+    offsets = [0]
+    with open(filename, 'rb') as f:
+        for i in range(1, nfiles):
+            target = max((size * i) // nfiles, offsets[-1])
+            if fasta:
+                b = find_record_start(f, target)
+            else:
+                b = find_line_start(f, target)
+            offsets.append(min(b, size))
+    offsets.append(size)
+    return offsets
+
+
+def copy_range(filename, start, end, outfile, blocksize=4194304):
+    with open(filename, 'rb') as f, open(outfile, 'wb') as of:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(blocksize, remaining))
+            if len(block) == 0:
+                break
+            of.write(block)
+            remaining -= len(block)
+    logging.debug(f"wrote {outfile} bytes {start}-{end}")
+    return outfile
+
+
+def do_split(filename, nfiles, fasta=False, nthreads=4):
+    """
+    Writes exactly nfiles pieces, <filename>.1 ... <filename>.<nfiles>, of roughly equal 
+    size, split on line (or FASTA record) boundaries. Input is read once. 
+    """
     logging.debug(f"splitting {filename} into {nfiles} pieces...")
-    nlines = file_len(filename)
-    logging.debug(f"{filename} has {nlines} lines.")
-    lpf = int(nlines / nfiles)
-    logging.debug(f"will put {lpf} lines per file...")
-    fnum = 1
-    of = None
-    with open(filename) as f:
-        for i, l in enumerate(f):
-            if i % lpf == 0:
-                if of is not None:
-                    logging.debug("closing file...")
-                    of.close()
-                    fnum += 1
-                logging.debug(f"opening new file= {filename}.{fnum} ")
-                of = open(f"{filename}.{fnum}", 'w')
-            of.write(l)
-    of.close()
-    f.close()
+    offsets = get_split_offsets(filename, nfiles, fasta)
+    logging.debug(f"split offsets: {offsets}")
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        futures = [ executor.submit(copy_range, filename, offsets[i], offsets[i + 1], f"{filename}.{i + 1}")
+                    for i in range(nfiles) ]
+        for fu in futures:
+            fu.result()
+    logging.info(f"split {filename} into {nfiles} pieces.")
         
     
 
@@ -63,6 +101,18 @@ if __name__ == '__main__':
                         dest='verbose', 
                         help='verbose logging')
 
+    parser.add_argument('-f', '--fasta', 
+                        action="store_true", 
+                        dest='fasta', 
+                        help='only split at FASTA record starts')
+
+    parser.add_argument('-t', '--threads', 
+                        action="store", 
+                        dest='threads', 
+                        type=int,
+                        default=4,
+                        help='number of pieces to write concurrently [4]')
+
     parser.add_argument('infile', 
                         metavar='infile', 
                         type=str, 
@@ -81,4 +131,6 @@ if __name__ == '__main__':
     if args.verbose:
         logging.getLogger().setLevel(logging.INFO)
     
-    do_split(args.infile, args.nfiles)
\ No newline at end of file
+    if args.nfiles < 1:
+        parser.error("nfiles must be at least 1")
+    do_split(args.infile, args.nfiles, args.fasta, args.threads)
\ No newline at end of file
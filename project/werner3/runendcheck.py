@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 #   Usage: runendcheck.py <basefile> <inputdir> <outputdir> 
+#          runendcheck.py -l -n 16 <basefile> <inputdir> <outputdir>    all tasks, locally
 #$ -N werner3
 #$ -wd $HOME/project/$JOB_NAME
 #$ -pe threads 2
@@ -11,30 +12,26 @@
 import argparse
 import logging
 import os
-import subprocess
 import sys
 
 gitpath=os.path.expanduser("~/git/cshlwork")
 sys.path.append(gitpath)
 
 from utils import elzar
+from utils import bamtool
+from utils.resultsink import ResultSink
 
 FILEBLOCK = 10
+# (require, exclude) flag masks, as samtools view -c -f <require> -F <exclude>
+QUERIES = [ (1, 0) ]
 
-def run_samview(infile):
+def run_samview(infiles, nprocs=2):
 	'''
-	Runs sam view. Returns single return line. 
+	Counts records matching QUERIES in each BAM, as samtools view -c -f 1, in-process 
+	and concurrently. Returns list of (infile, counts) with counts one per query, 
+	or None on error.  
 	'''
-	command = f"samtools view -c -f 1 {infile}"
-	commandlist = command.split()
-	logging.debug(f"command is {command}")
-	try:
-		p = subprocess.run(commandlist, check=True, stdout=subprocess.PIPE, universal_newlines=True)
-		output = p.stdout
-		lines = output.split('\n')
-	except subprocess.CalledProcessError:
-		logging.warning(f"Problem with {infile}")
-	return output.strip()
+	return bamtool.count_bams(infiles, QUERIES, nprocs)
 
 
 def parse_basefile(basefile):
@@ -44,39 +41,75 @@ def parse_basefile(basefile):
 	return flist
  
 
-def run_all(basefile, indir, outdir):
-	taskid = elzar.get_taskid()
-	logging.debug(f"taskid is {taskid}")
-
+def get_block(blist, taskid):
+	'''
+	Files of grid task taskid, FILEBLOCK per task. 
+	'''
 	lowidx = (taskid - 1) * FILEBLOCK 
 	highidx = taskid * FILEBLOCK
 	logging.debug(f"lowidx={lowidx} highidx={highidx} ")
+	return blist[lowidx:highidx]
+
+
+def run_all(basefile, indir, outdir, nprocs=2):
+	taskid = elzar.get_taskid()
+	logging.debug(f"taskid is {taskid}")
 	blist = parse_basefile(basefile)
 	logging.debug(f"basefile raw len={len(blist)}")	
-	blist = blist[lowidx:highidx]
+	blist = get_block(blist, taskid)
 	logging.debug(f"basefile processed len={len(blist)}")
+	return run_block(blist, indir, nprocs)
+
+
+def run_block(blist, indir, nprocs=2):
+	blist = [ bf.strip() for bf in blist ]
+	inlist = [ f"{indir}/{bf}" for bf in blist ]
 	donelist = []
-	for bf in blist:
-		bf = bf.strip()
-		infile=f"{indir}/{bf}"
-		try:
-			out = run_samview(infile)
-			logging.debug(f"got {out} for {bf}. next...")
-			donelist.append( (bf, out))
-		except:
+	for (bf, (infile, out)) in zip(blist, run_samview(inlist, nprocs)):
+		if out is None:
 			logging.warning(f"got exception from infile {infile}")
+			continue
+		logging.debug(f"got {out} for {bf}. next...")
+		donelist.append( (bf, out))
 	logging.debug("done. returning donelist.")
 	return donelist
 
-def write_output( outfile, tuplelist ):
-	logging.debug(f"writing out to {outfile}")
-	s = ""
-	for (a, b) in tuplelist:
-		s += f"{a}  {b}\n"
-	f = open(outfile, 'w')
-	f.write(s)
+
+def run_local(basefile, indir, outdir, nprocs=2):
+	'''
+	Runs all task blocks on this host, nprocs at a time, blocks balanced by file size. 
+	Task ids are local to the run, not grid FILEBLOCK ids, so the caller clears the 
+	result table first (clear_output). 
+	Returns list of (taskid, donelist).  
+	'''
+	blist = [ bf.strip() for bf in parse_basefile(basefile) if len(bf.strip()) > 0 ]
+	blocks = elzar.make_blocks(blist, nprocs * 4, elzar.get_file_sizes(blist, indir))
+	# one reader per task, tasks already run in parallel. 
+	return elzar.run_array(run_block, blocks, nprocs, indir, 1)
+
+
+def get_sink(outpath):
+	columns = [ ('filename', 'TEXT') ] + [ (f"f{r}_F{e}", 'INTEGER') for (r, e) in QUERIES ]
+	return ResultSink(outpath, 'ends', columns)
+
+
+def clear_output(outpath):
+	'''
+	Empties result table before a local run, so no rows of an earlier run remain. 
+	'''
+	with get_sink(outpath) as sink:
+		sink.clear()
+
+
+def write_output( outpath, tuplelist, taskid ):
+	'''
+	Appends task rows (filename, count per query) to shared result table. 
+	Read back with:  resultsink.py dump <outpath> ends
+	'''
+	logging.debug(f"writing out to {outpath}")
+	with get_sink(outpath) as sink:
+		sink.append([ [a] + list(b) for (a, b) in tuplelist ], taskid)
 	logging.debug("done writing.")
-	f.close()
 		
 
 if __name__ == '__main__':
@@ -93,6 +126,24 @@ if __name__ == '__main__':
                     dest='verbose', 
                     help='verbose logging')
 	
+	parser.add_argument('-n', '--nprocs',
+					action="store", 
+                    dest='nprocs', 
+                    type=int,
+                    default=2,
+                    help='concurrent BAM readers [2, as -pe threads]')
+	
+	parser.add_argument('-l', '--local',
+					action="store_true", 
+                    dest='local', 
+                    help='run all tasks on this host')
+	
+	parser.add_argument('-o', '--outpath',
+					action="store", 
+                    dest='outpath', 
+                    default=None,
+                    help='result table: Parquet dataset dir, or .sqlite for single host [<outdir>/ends]')
+	
 	parser.add_argument('basefile', 
                         metavar='basefile', 
                         type=str, 
@@ -115,10 +166,18 @@ if __name__ == '__main__':
 	if args.verbose:
 		logging.getLogger().setLevel(logging.INFO)
 		
-	outlist = run_all(args.basefile, args.indir, args.outdir)
-	taskid = elzar.get_taskid()
-	outfile = f"{args.outdir}/{taskid}_ends.out"
-	write_output(outfile, outlist)
+	outpath = args.outpath
+	if outpath is None:
+		outpath = f"{args.outdir}/ends"
+	if args.local:
+		tasklist = run_local(args.basefile, args.indir, args.outdir, args.nprocs)
+		clear_output(outpath)
+		for (taskid, outlist) in tasklist:
+			write_output(outpath, outlist, taskid)
+	else:
+		outlist = run_all(args.basefile, args.indir, args.outdir, args.nprocs)
+		taskid = elzar.get_taskid()
+		write_output(outpath, outlist, taskid)
 	#print(outlist)    
   
 
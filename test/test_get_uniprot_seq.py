@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+#  Checks get_uniprot_seq.down_seq against a local stand-in for the UniProt server:
+#  plain download, resume of a truncated .part file, and a server that gzip-encodes
+#  responses regardless of Accept-Encoding.
+#
+#  test_get_uniprot_seq.py  [-d]     or     pytest test/test_get_uniprot_seq.py
+#
+import argparse
+import gzip
+import http.server
+import logging
+import os
+import re
+import socketserver
+import sys
+import tempfile
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'project', 'jones'))
+import get_uniprot_seq
+
+DATA = b''.join([ b'>sp|P%05d|TEST_HUMAN Test protein\n' % i + b'ACDEFGHIKLMNPQRSTVWY' * 30 + b'\n'
+                  for i in range(500) ])
+
+
+class UniprotHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves DATA for any query, honouring byte Ranges. With server.gzip set, encodes
+    every response, and Ranges count encoded bytes, as a real gzip server would.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        body = gzip.compress(DATA) if self.server.gzip else DATA
+        total = len(body)
+        start = 0
+        rng = self.headers.get('Range')
+        if rng is not None:
+            start = int(re.match(r'bytes=(\d+)-', rng).group(1))
+            if start >= total:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{total}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        body = body[start:]
+        self.send_response(206 if rng is not None else 200)
+        if rng is not None:
+            self.send_header('Content-Range', f"bytes {start}-{total - 1}/{total}")
+        if self.server.gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class UniprotServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, gzip=False):
+        super().__init__(('127.0.0.1', 0), UniprotHandler)
+        self.gzip = gzip
+        self.requests = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def get_baseurl(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/uniprot/"
+
+
+def run_down_seq(server, outdir, partial=None):
+    if partial is not None:
+        with open(f"{outdir}/human_sequences.fasta.part", 'wb') as f:
+            f.write(partial)
+    (orgid, outfile, size) = get_uniprot_seq.down_seq(9606, 'human', baseurl=server.get_baseurl(),
+                                                      outdir=outdir, retries=1)
+    with open(outfile, 'rb') as f:
+        data = f.read()
+    return (outfile, size, data)
+
+
+def test_plain_download():
+    server = UniprotServer()
+    with tempfile.TemporaryDirectory() as outdir:
+        (outfile, size, data) = run_down_seq(server, outdir)
+        assert data == DATA
+        assert size == len(DATA)
+        assert not os.path.exists(f"{outfile}.part")
+    assert len(server.requests) == 1
+    assert server.requests[0]['Accept-Encoding'] == 'identity'
+    server.shutdown()
+
+
+def test_resume_truncated():
+    server = UniprotServer()
+    with tempfile.TemporaryDirectory() as outdir:
+        offset = len(DATA) // 3
+        (outfile, size, data) = run_down_seq(server, outdir, partial=DATA[:offset])
+        assert data == DATA
+    assert len(server.requests) == 1
+    assert server.requests[0]['Range'] == f"bytes={offset}-"
+    assert server.requests[0]['Accept-Encoding'] == 'identity'
+    server.shutdown()
+
+
+def test_gzip_server():
+    server = UniprotServer(gzip=True)
+    with tempfile.TemporaryDirectory() as outdir:
+        (outfile, size, data) = run_down_seq(server, outdir)
+        assert data == DATA
+        assert size == len(DATA)
+    server.shutdown()
+
+
+def test_gzip_server_resume():
+    # encoded Range can't be appended to decoded part file, so restarts from zero.
+    server = UniprotServer(gzip=True)
+    with tempfile.TemporaryDirectory() as outdir:
+        (outfile, size, data) = run_down_seq(server, outdir, partial=DATA[:len(DATA) // 3])
+        assert data == DATA
+    assert 'Range' in server.requests[0]
+    assert 'Range' not in server.requests[-1]
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    FORMAT='%(asctime)s (UTC) [ %(levelname)s ] %(filename)s:%(lineno)d %(name)s.%(funcName)s(): %(message)s'
+    logging.basicConfig(format=FORMAT)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-d', '--debug',
+                        action="store_true",
+                        dest='debug',
+                        help='debug logging')
+
+    args= parser.parse_args()
+
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    for test in [ test_plain_download, test_resume_truncated, test_gzip_server, test_gzip_server_resume ]:
+        test()
+        print(f"{test.__name__} ok")
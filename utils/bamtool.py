@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+#  In-process BAM flag counting, no samtools needed.
+#
+#  A BAM file is a series of BGZF blocks, each a gzip member with a 'BC' extra field
+#  giving its size. Blocks are inflated with zlib, and alignment records walked just
+#  far enough to read each FLAG. One pass builds a histogram of all 65536 flag values,
+#  from which any number of samtools-style queries are answered:
+#
+#     samtools view -c -f 1 x.bam          ->   (1, 0)
+#     samtools view -c -f 1 -F 12 x.bam    ->   (1, 12)
+#
+#  bamtool.py count [-q 1:0] [-q 1:12] [-n <nprocs>] <bam> [<bam> ...]
+#
+
+import argparse
+import logging
+import os
+import struct
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+BGZF_HEADER = struct.Struct('<4BI2BH')
+READSIZE = 4194304
+
+
+def iter_bgzf_blocks(filehandle):
+    """
+    Yields inflated data of each BGZF block. Raises ValueError on non-BGZF input.
+    """
+    while True:
+        header = filehandle.read(12)
+        if len(header) == 0:
+            return
+        if len(header) < 12:
+            raise ValueError("truncated BGZF block header")
+        (id1, id2, cm, flg, mtime, xfl, os_, xlen) = BGZF_HEADER.unpack(header)
+        if id1 != 31 or id2 != 139 or not (flg & 4):
+            raise ValueError("not a BGZF file")
+        extra = filehandle.read(xlen)
+        bsize = None
+        i = 0
+        while i + 4 <= len(extra):
+            slen = struct.unpack_from('<H', extra, i + 2)[0]
+            if extra[i:i + 2] == b'BC':
+                bsize = struct.unpack_from('<H', extra, i + 4)[0]
+            i += 4 + slen
+        if bsize is None:
+            raise ValueError("BGZF block without BC field")
+        # BSIZE is total block size - 1. Remainder is deflate data, CRC32, ISIZE.
+        rest = filehandle.read(bsize + 1 - 12 - xlen)
+        data = zlib.decompress(rest[:-8], -15)
+        (crc, isize) = struct.unpack('<II', rest[-8:])
+        if isize != len(data) or crc != (zlib.crc32(data) & 0xffffffff):
+            raise ValueError("BGZF block failed CRC/size check")
+        yield data
+
+
+def iter_bam_chunks(filename, readsize=READSIZE):
+    """
+    Yields inflated BAM data in pieces of at least readsize bytes, joining blocks
+    so record walking runs over large buffers.
+    """
+    with open(filename, 'rb') as f:
+        pieces = []
+        size = 0
+        for data in iter_bgzf_blocks(f):
+            pieces.append(data)
+            size += len(data)
+            if size >= readsize:
+                yield b''.join(pieces)
+                pieces = []
+                size = 0
+        if size > 0:
+            yield b''.join(pieces)
+
+
+def skip_bam_header(buf):
+    """
+    Returns offset of first alignment record in buf, or None if header is not
+    complete in buf yet.
+    """
+    if len(buf) < 8:
+        return None
+    if buf[:4] != b'BAM\x01':
+        raise ValueError("not a BAM file")
+    ltext = struct.unpack_from('<i', buf, 4)[0]
+    pos = 8 + ltext
+    if len(buf) < pos + 4:
+        return None
+    nref = struct.unpack_from('<i', buf, pos)[0]
+    pos += 4
+    for i in range(nref):
+        if len(buf) < pos + 4:
+            return None
+        lname = struct.unpack_from('<i', buf, pos)[0]
+        pos += 4 + lname + 4
+    if len(buf) < pos:
+        return None
+    return pos
+
+
+def get_flag_histogram(filename):
+    """
+    Counts of each FLAG value over all records in BAM file. int64 array, length 65536.
+    """
+    hist = np.zeros(65536, dtype=np.int64)
+    unpack_size = struct.Struct('<i').unpack_from
+    unpack_flag = struct.Struct('<H').unpack_from
+    buf = b''
+    inheader = True
+    nrec = 0
+    for chunk in iter_bam_chunks(filename):
+        buf = buf + chunk if len(buf) > 0 else chunk
+        pos = 0
+        if inheader:
+            start = skip_bam_header(buf)
+            if start is None:
+                continue
+            pos = start
+            inheader = False
+        flags = []
+        end = len(buf)
+        while pos + 4 <= end:
+            bsize = unpack_size(buf, pos)[0]
+            if pos + 4 + bsize > end:
+                break
+            # block_size, refID, pos, l_read_name, mapq, bin, n_cigar_op, then flag.
+            flags.append(unpack_flag(buf, pos + 18)[0])
+            pos += 4 + bsize
+        hist += np.bincount(np.array(flags, dtype=np.int64), minlength=65536)
+        nrec += len(flags)
+        buf = buf[pos:]
+    if inheader or len(buf) > 0:
+        raise ValueError(f"truncated BAM file {filename}")
+    logging.debug(f"counted {nrec} records in {filename}")
+    return hist
+
+
+def count_flags(hist, require=0, exclude=0):
+    """
+    Number of records with all require bits set and no exclude bits set, as
+    samtools view -c -f <require> -F <exclude>
+    """
+    flags = np.arange(65536)
+    mask = ((flags & require) == require) & ((flags & exclude) == 0)
+    return int(hist[mask].sum())
+
+
+def count_bam(filename, queries=[(1, 0)]):
+    """
+    List of counts, one per (require, exclude) query, from single pass over file.
+    """
+    hist = get_flag_histogram(filename)
+    return [ count_flags(hist, require, exclude) for (require, exclude) in queries ]
+
+
+def count_bam_safe(filename, queries):
+    try:
+        return count_bam(filename, queries)
+    except (OSError, ValueError, zlib.error) as e:
+        logging.warning(f"Problem with {filename}: {e}")
+        return None
+
+
+def count_bams(filelist, queries=[(1, 0)], nprocs=None):
+    """
+    Counts many BAM files concurrently. Returns list of (filename, counts) in
+    filelist order, counts None for unreadable files.
+    """
+    filelist = list(filelist)
+    if nprocs is None:
+        nprocs = os.cpu_count()
+    nprocs = max(1, min(nprocs, len(filelist)))
+    if nprocs == 1:
+        results = [ count_bam_safe(fn, queries) for fn in filelist ]
+    else:
+        with ProcessPoolExecutor(max_workers=nprocs) as ex:
+            results = list(ex.map(count_bam_safe, filelist, [queries] * len(filelist)))
+    return list(zip(filelist, results))
+
+
+def parse_query(qstr):
+    """
+    '1:12' -> (1, 12)    '1' -> (1, 0)    '0x4:0' -> (4, 0)
+    """
+    fields = qstr.split(':')
+    require = int(fields[0], 0) if len(fields[0]) > 0 else 0
+    exclude = int(fields[1], 0) if len(fields) > 1 and len(fields[1]) > 0 else 0
+    return (require, exclude)
+
+
+if __name__ == '__main__':
+    FORMAT='%(asctime)s (UTC) [ %(levelname)s ] %(filename)s:%(lineno)d %(name)s.%(funcName)s(): %(message)s'
+    logging.basicConfig(format=FORMAT)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-d', '--debug',
+                        action="store_true",
+                        dest='debug',
+                        help='debug logging')
+
+    parser.add_argument('-v', '--verbose',
+                        action="store_true",
+                        dest='verbose',
+                        help='verbose logging')
+
+    parser.add_argument('-q', '--query',
+                        action="append",
+                        dest='queries',
+                        default=None,
+                        help='<require>:<exclude> flag query, repeatable [1:0]')
+
+    parser.add_argument('-n', '--nprocs',
+                        action="store",
+                        dest='nprocs',
+                        type=int,
+                        default=None,
+                        help='number of worker processes [all cores]')
+
+    parser.add_argument('command',
+                        metavar='command',
+                        type=str,
+                        choices=['count'],
+                        help='count')
+
+    parser.add_argument('infiles',
+                        metavar='infiles',
+                        type=str,
+                        nargs='+',
+                        help='BAM files')
+
+    args= parser.parse_args()
+
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    queries = [ parse_query(q) for q in (args.queries or ['1:0']) ]
+    for (fn, counts) in count_bams(args.infiles, queries, args.nprocs):
+        if counts is None:
+            counts = ['NA'] * len(queries)
+        print(f"{fn}\t" + "\t".join([ str(c) for c in counts ]))
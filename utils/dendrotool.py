@@ -23,6 +23,7 @@ class Phylogeny(object):
         self.distmatrix = None
         self.df = None
         self.filepath = filepath
+        self.nodes = None
         
     def __repr__(self):
         pass
@@ -33,7 +34,7 @@ class Phylogeny(object):
         """
         self.log.debug("Reading file %s" % filepath)
         self.filepath = filepath
-        self.tree = dp.Tree.get_from_path(args.infile, 
+        self.tree = dp.Tree.get_from_path(filepath, 
                                  schema='newick',
                                  suppress_internal_node_taxa=True, 
                                  suppress_leaf_node_taxa=True,
@@ -42,25 +43,98 @@ class Phylogeny(object):
         #self.tree = Phylo.read(filepath, 'newick')
         self.log.debug("tree is %s" % self.tree )
         #print(tree)
-  
+        self.nodes = None
+
+    def flatten(self):
+        """
+        Flattens tree once into level-order arrays, without recursion:
+            nodes       dendropy nodes, root first, each level contiguous
+            parent      int64 index of parent node, -1 for root
+            edgelen     float64 length of edge to parent, 0 if unset
+            level       int32 depth in edges from root
+            levelstart  nodes of level l are nodes[levelstart[l]:levelstart[l+1]]
+            childstart  children of node i are nodes[childstart[i]:childstart[i] + nchildren[i]]
+            nchildren   int64 
+            leaves      int64 indices of leaf nodes
+            labels      taxon label (or node label) per node, None if unlabelled
+        """
+        nodes = [ self.tree.seed_node ]
+        parent = [ -1 ]
+        level = [ 0 ]
+        childstart = []
+        nchildren = []
+        i = 0
+        while i < len(nodes):
+            children = nodes[i].child_nodes()
+            childstart.append(len(nodes))
+            nchildren.append(len(children))
+            nodes.extend(children)
+            parent.extend([i] * len(children))
+            level.extend([level[i] + 1] * len(children))
+            i += 1
+        
+        self.nodes = nodes
+        self.parent = np.array(parent, dtype=np.int64)
+        self.level = np.array(level, dtype=np.int32)
+        self.edgelen = np.array([ (n.edge.length or 0.0) if n.edge is not None else 0.0 for n in nodes ], 
+                                dtype=np.float64)
+        self.edgelen[0] = 0.0
+        self.childstart = np.array(childstart, dtype=np.int64)
+        self.nchildren = np.array(nchildren, dtype=np.int64)
+        self.levelstart = np.searchsorted(self.level, np.arange(self.level[-1] + 2))
+        self.leaves = np.flatnonzero(self.nchildren == 0)
+        self.labels = [ n.taxon.label if n.taxon is not None else n.label for n in nodes ]
+        self.log.debug("flattened %d nodes, %d leaves, %d levels" % (len(nodes), len(self.leaves), 
+                                                                    len(self.levelstart) - 1))
+
+    def simulate_values(self, start=1.0, seed=None):
+        """
+        Gaussian trait simulation root to leaves, as process_node(): each node value is 
+        drawn from N(parent value, edge length). One vectorized draw per level. 
+        Returns float64 array of values, indexed like self.nodes. 
+        """
+        if self.nodes is None:
+            self.flatten()
+        rng = np.random.default_rng(seed)
+        values = np.empty(len(self.nodes), dtype=np.float64)
+        values[0] = start
+        for l in range(1, len(self.levelstart) - 1):
+            (s, e) = (self.levelstart[l], self.levelstart[l + 1])
+            values[s:e] = rng.normal(values[self.parent[s:e]], self.edgelen[s:e])
+        return values
+
+    def get_leaf_values(self, values):
+        """
+        dict leaf label -> value, for values indexed like self.nodes. 
+        """
+        return { self.labels[i] : values[i] for i in self.leaves }
+
 
 
 def process_node(node, start=1.0):
+    """
+    Sets node.value on node and all descendants. Uses explicit stack, so deep 
+    trees don't hit the recursion limit. For whole trees, Phylogeny.simulate_values()
+    """
     if node.parent_node is None:
         node.value = start
     else:
         node.value = random.gauss(node.parent_node.value, node.edge.length)
-    for child in node.child_nodes():
-        process_node(child)
-    if node.taxon is not None:
-        print("%s : %s" % (node.taxon, node.value))
+    stack = [ node ]
+    while stack:
+        node = stack.pop()
+        for child in node.child_nodes():
+            child.value = random.gauss(node.value, child.edge.length)
+            stack.append(child)
+        if node.taxon is not None:
+            print("%s : %s" % (node.taxon, node.value))
 
 
 def test_dendropy(infile):
         
     p = Phylogeny()
     p.parsefile(infile)
-        
+    tree = p.tree
     
     #print(f"description = {tree.description()}")
     print(f"seed_node = {tree.seed_node}")
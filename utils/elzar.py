@@ -1,5 +1,19 @@
+#!/usr/bin/env python
+#
+#  SGE array job helpers, and local emulation of array jobs.
+#
+#  On the grid each task finds its work from SGE_TASK_ID. Locally, run_array() runs
+#  all task blocks across a process pool, with SGE_TASK_ID set in each task, and
+#  returns per-task results in task order for merging.
+#
+
+import logging
 import os
 
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
 
 def get_taskid():
     tid = 1
@@ -10,3 +24,60 @@ def get_taskid():
     return tid
 
 
+def make_blocks(items, nblocks, sizes=None):
+    """
+    Splits items into at most nblocks contiguous blocks, in order, with roughly equal
+    total size. sizes e.g. file sizes in bytes; equal counts if None.
+    Block k (0-based) is the work of task k + 1.
+    """
+    items = list(items)
+    if len(items) == 0:
+        return []
+    nblocks = max(1, min(nblocks, len(items)))
+    if sizes is None:
+        sizes = np.ones(len(items))
+    # empty files still cost an open, so count them a little.
+    sizes = np.maximum(np.asarray(sizes, dtype=np.float64), 1.0)
+    cum = np.cumsum(sizes)
+    targets = cum[-1] * np.arange(1, nblocks) / nblocks
+    # cut after whichever item brings the running total closest to each target.
+    idx = np.searchsorted(cum, targets, side='left')
+    prev = np.where(idx > 0, cum[np.maximum(idx - 1, 0)], 0.0)
+    cuts = np.where((idx == 0) | (cum[idx] - targets <= targets - prev), idx + 1, idx)
+    bounds = [0] + sorted(set(int(c) for c in cuts if 0 < c < len(items))) + [len(items)]
+    blocks = [ items[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1) ]
+    logging.debug(f"made {len(blocks)} blocks of {len(items)} items, "
+                  f"sizes {min(len(b) for b in blocks)}-{max(len(b) for b in blocks)} items")
+    return blocks
+
+
+def get_file_sizes(filelist, indir=None):
+    sizes = []
+    for fn in filelist:
+        fp = fn if indir is None else f"{indir}/{fn}"
+        try:
+            sizes.append(os.path.getsize(fp))
+        except OSError:
+            sizes.append(0)
+    return sizes
+
+
+def run_task(func, taskid, block, args):
+    os.environ['SGE_TASK_ID'] = str(taskid)
+    return func(block, *args)
+
+
+def run_array(func, blocks, nprocs=None, *args):
+    """
+    Runs func(block, *args) for each block as task 1..N across nprocs processes,
+    with SGE_TASK_ID set as on the grid. func must be importable (module level).
+    Returns list of (taskid, result) in task order.
+    """
+    if nprocs is None:
+        nprocs = os.cpu_count()
+    nprocs = max(1, min(nprocs, len(blocks)))
+    taskids = list(range(1, len(blocks) + 1))
+    logging.info(f"running {len(blocks)} tasks on {nprocs} processes")
+    with ProcessPoolExecutor(max_workers=nprocs) as ex:
+        results = list(ex.map(run_task, [func] * len(blocks), taskids, blocks, [args] * len(blocks)))
+    return list(zip(taskids, results))
@@ -0,0 +1,568 @@
+#!/usr/bin/env python
+#
+#  Shared FASTA handling.
+#
+#  read_fasta:  streaming generator of FastaRecords, from path or open file.
+#  FastaWriter: buffered, line-wrapping FASTA output, usable as context manager.
+#  get_record_ranges / read_range_lines / read_fasta_range:
+#               split a big FASTA into byte ranges on record boundaries, for
+#               parallel parsing in worker processes.
+#  shard_fasta: stream records into N balanced shard files, with accession -> shard
+#               index, and shard list usable as array job basefile.
+#  FastaIndex:  faidx-style byte offset index of a (UniProt) FASTA file, persisted
+#               in a sidecar <fasta>.fxi.npz, for random-access sequence fetch.
+#
+#  >sp|Q8CJG1|AGO1_MOUSE  Protein argonaute-1 OS=Mus musculus OX=10090 GN=Ago1 PE=1 SV=2
+#       db  accession  pid
+#
+#  fastatool.py index <fasta>
+#  fastatool.py fetch <fasta> <acc> [<acc> ...]
+#
+
+import argparse
+import heapq
+import logging
+import os
+
+import numpy as np
+
+
+def parse_header_ids(header):
+    """
+    Returns (accession, pid) from header line, with or without leading '>'.
+    For UniProt headers db|acc|pid, otherwise (<first word>, <first word>)
+    """
+    if header.startswith('>'):
+        header = header[1:]
+    fields = header.split(None, 1)
+    if len(fields) == 0:
+        return ('', '')
+    first = fields[0]
+    parts = first.split('|')
+    if len(parts) >= 3:
+        return (parts[1], parts[2])
+    return (first, first)
+
+
+class FastaRecord(object):
+    """
+    One FASTA record. Header fields are only parsed when first asked for.
+
+    header       'sp|Q8CJG1|AGO1_MOUSE Protein argonaute-1 OS=Mus musculus OX=10090 GN=Ago1 PE=1 SV=2'
+    sequence     'MEAGPSGAA...'
+    accession    'Q8CJG1'
+    pid          'AGO1_MOUSE'
+    db           'sp'
+    description  'Protein argonaute-1 OS=Mus musculus OX=10090 GN=Ago1 PE=1 SV=2'
+    tags         { 'OS' : 'Mus musculus', 'OX' : '10090', 'GN' : 'Ago1', 'PE' : '1', 'SV' : '2' }
+
+    """
+    __slots__ = ['header', 'sequence', '_ids', '_tags']
+
+    def __init__(self, header, sequence):
+        self.header = header
+        self.sequence = sequence
+        self._ids = None
+        self._tags = None
+
+    def __repr__(self):
+        return f"FastaRecord: {self.header[:40]} len={len(self.sequence)}"
+
+    def __len__(self):
+        return len(self.sequence)
+
+    @property
+    def accession(self):
+        if self._ids is None:
+            self._ids = parse_header_ids(self.header)
+        return self._ids[0]
+
+    @property
+    def pid(self):
+        if self._ids is None:
+            self._ids = parse_header_ids(self.header)
+        return self._ids[1]
+
+    @property
+    def db(self):
+        parts = self.header.split(None, 1)[0].split('|')
+        if len(parts) >= 3:
+            return parts[0]
+        return None
+
+    @property
+    def description(self):
+        fields = self.header.split(None, 1)
+        if len(fields) > 1:
+            return fields[1]
+        return ''
+
+    @property
+    def tags(self):
+        """
+        UniProt KEY=value tags from description.  Values may contain spaces (OS=Mus musculus).
+        """
+        if self._tags is None:
+            self._tags = {}
+            key = None
+            for t in self.description.split():
+                if len(t) > 3 and t[2] == '=' and t[:2].isupper():
+                    key = t[:2]
+                    self._tags[key] = t[3:]
+                elif key is not None:
+                    self._tags[key] = f"{self._tags[key]} {t}"
+        return self._tags
+
+
+def read_fasta(source):
+    """
+    Streams FastaRecords from filename or open text file handle.
+    Sequence lines are collected as chunks and joined once per record.
+    Lines starting with '#' and blank lines are skipped.
+    """
+    if isinstance(source, str):
+        with open(os.path.expanduser(source), 'r') as f:
+            yield from read_fasta(f)
+        return
+
+    header = None
+    chunks = []
+    for line in source:
+        if line.startswith('>'):
+            if header is not None:
+                yield FastaRecord(header, ''.join(chunks))
+            header = line[1:].strip()
+            chunks = []
+        elif line.startswith('#'):
+            pass
+        else:
+            s = line.strip()
+            if len(s) > 0 and header is not None:
+                chunks.append(s)
+    if header is not None:
+        yield FastaRecord(header, ''.join(chunks))
+
+
+def find_record_start(filehandle, offset, blocksize=1048576):
+    """
+    Offset of first record start ('>' at line start) at or after offset, or file size.
+    filehandle must be open binary.
+    """
+    if offset <= 0:
+        return 0
+    filehandle.seek(offset - 1)
+    pos = offset - 1
+    carry = b''
+    while True:
+        block = filehandle.read(blocksize)
+        if len(block) == 0:
+            return filehandle.seek(0, os.SEEK_END)
+        data = carry + block
+        i = data.find(b'\n>')
+        if i >= 0:
+            return pos - len(carry) + i + 1
+        carry = data[-1:]
+        pos += len(block)
+
+
+def get_record_ranges(filepath, nranges):
+    """
+    Divides file into up to nranges (start, end) byte ranges of roughly equal size,
+    each starting at a record start. Ranges cover the whole file.
+    """
+    filepath = os.path.expanduser(filepath)
+    size = os.path.getsize(filepath)
+    bounds = [0]
+    with open(filepath, 'rb') as f:
+        for k in range(1, nranges):
+            b = find_record_start(f, (k * size) // nranges)
+            if b > bounds[-1] and b < size:
+                bounds.append(b)
+    bounds.append(size)
+    ranges = list(zip(bounds[:-1], bounds[1:]))
+    logging.debug(f"split {filepath} size={size} into {len(ranges)} ranges.")
+    return ranges
+
+
+def read_range_lines(filepath, start, end):
+    """
+    Yields raw (bytes) lines from byte range of file. Range must be line-aligned.
+    """
+    with open(os.path.expanduser(filepath), 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        for line in f:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+            yield line
+
+
+def read_fasta_range(filepath, start, end):
+    """
+    Streams FastaRecords for records in byte range from get_record_ranges().
+    """
+    lines = ( line.decode() for line in read_range_lines(filepath, start, end) )
+    yield from read_fasta(lines)
+
+
+class FastaWriter(object):
+    """
+    Buffered FASTA writer. Sequences are wrapped at linewidth (0 or None for one line).
+    Output is accumulated up to buffersize characters between writes.
+
+    with FastaWriter(outfile) as fw:
+        for rec in read_fasta(infile):
+            fw.write_record(rec)
+        fw.write('G803000000001 B5X0T5_SALSA', seq)
+
+    """
+
+    def __init__(self, filepath, linewidth=60, buffersize=4194304, mode='w'):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.filepath = os.path.expanduser(filepath)
+        self.linewidth = linewidth
+        self.buffersize = buffersize
+        self.mode = mode
+        self.filehandle = None
+        self.buffer = []
+        self.buffered = 0
+        self.numwritten = 0
+
+    def __repr__(self):
+        return f"FastaWriter: {self.filepath} linewidth={self.linewidth} written={self.numwritten}"
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def open(self):
+        self.filehandle = open(self.filepath, self.mode)
+
+    def write(self, header, sequence):
+        """
+        header without leading '>'
+        """
+        if self.linewidth:
+            w = self.linewidth
+            seqtext = '\n'.join([ sequence[i:i + w] for i in range(0, len(sequence), w) ])
+        else:
+            seqtext = sequence
+        if len(seqtext) > 0:
+            entry = f">{header}\n{seqtext}\n"
+        else:
+            entry = f">{header}\n"
+        self.buffer.append(entry)
+        self.buffered += len(entry)
+        self.numwritten += 1
+        if self.buffered >= self.buffersize:
+            self.flush()
+
+    def write_record(self, record):
+        self.write(record.header, record.sequence)
+
+    def write_records(self, records):
+        for rec in records:
+            self.write(rec.header, rec.sequence)
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.filehandle.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        if self.filehandle is not None:
+            self.flush()
+            self.filehandle.close()
+            self.filehandle = None
+            self.log.debug(f"wrote {self.numwritten} sequences to {self.filepath}")
+
+
+def shard_fasta(records, workdir, nshards, balance='count', prefix='shard', linewidth=60):
+    """
+    Writes records into nshards FASTA files in one streaming pass, one open handle per shard.
+
+    balance='count'     round-robin, shards differ by at most one record.
+    balance='residues'  each record to shard with fewest residues so far.
+
+    Writes:
+        <workdir>/<prefix>.<k>.fasta   k = 1..nshards, so shard k <-> SGE_TASK_ID k
+        <workdir>/<prefix>.idx         <accession> <tab> <k>
+        <workdir>/<prefix>.list        shard paths, one per line, in k order
+
+    Returns list of shard paths.
+    """
+    workdir = os.path.abspath(os.path.expanduser(workdir))
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+    shardlist = [ f"{workdir}/{prefix}.{k}.fasta" for k in range(1, nshards + 1) ]
+    writers = [ FastaWriter(sp, linewidth=linewidth, buffersize=262144) for sp in shardlist ]
+    loads = [ (0, k) for k in range(nshards) ]
+    counts = [0] * nshards
+    residues = [0] * nshards
+    nrec = 0
+    try:
+        for fw in writers:
+            fw.open()
+        with open(f"{workdir}/{prefix}.idx", 'w') as idxf:
+            for rec in records:
+                if balance == 'residues':
+                    (load, k) = heapq.heappop(loads)
+                    heapq.heappush(loads, (load + len(rec.sequence), k))
+                else:
+                    k = nrec % nshards
+                writers[k].write_record(rec)
+                idxf.write(f"{rec.accession}\t{k + 1}\n")
+                counts[k] += 1
+                residues[k] += len(rec.sequence)
+                nrec += 1
+    finally:
+        for fw in writers:
+            fw.close()
+
+    with open(f"{workdir}/{prefix}.list", 'w') as lf:
+        for sp in shardlist:
+            lf.write(f"{sp}\n")
+    logging.info(f"wrote {nrec} records to {nshards} shards in {workdir}. "
+                 f"records/shard {min(counts)}-{max(counts)} residues/shard {min(residues)}-{max(residues)}")
+    return shardlist
+
+
+class FastaIndex(object):
+    """
+    Byte-offset index of a FASTA file.
+
+    For each record:  accession, pid, header offset, sequence offset, sequence length,
+                      raw (on-disk) sequence length, line bases, line width.
+
+    Arrays are held sorted by accession, so lookups are binary searches, and
+    batches are fetched in file order.
+
+    fi = FastaIndex('uniprot_trembl.fasta')
+    seq = fi.fetch('Q8CJG1')
+    seqmap = fi.fetch_many(acclist)
+
+    """
+
+    def __init__(self, filepath, indexpath=None):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.filepath = os.path.abspath(os.path.expanduser(filepath))
+        if indexpath is None:
+            indexpath = f"{self.filepath}.fxi.npz"
+        self.indexpath = indexpath
+        self.index = None
+        self.load()
+
+    def __repr__(self):
+        n = 0
+        if self.index is not None:
+            n = len(self.index['acc'])
+        return f"FastaIndex: {self.filepath} {n} records"
+
+    def __len__(self):
+        return len(self.index['acc'])
+
+    def __contains__(self, acc):
+        return self.lookup([acc])[0] >= 0
+
+    def is_current(self):
+        if not os.path.exists(self.indexpath):
+            return False
+        return os.path.getmtime(self.indexpath) >= os.path.getmtime(self.filepath)
+
+    def load(self):
+        if self.is_current():
+            self.log.debug(f"loading index {self.indexpath}")
+            npz = np.load(self.indexpath)
+            self.index = { k : npz[k] for k in npz.files }
+        else:
+            self.build()
+            self.save()
+
+    def build(self):
+        """
+        Single pass over file, in binary, recording offsets.
+        """
+        self.log.info(f"building index for {self.filepath} ...")
+        acclist = []
+        pidlist = []
+        hdroffsets = []
+        seqoffsets = []
+        seqlens = []
+        rawlens = []
+        linebases = []
+        linewidths = []
+
+        offset = 0
+        seqlen = 0
+        lbases = 0
+        lwidth = 0
+        with open(self.filepath, 'rb') as f:
+            for line in f:
+                if line.startswith(b'>'):
+                    if len(hdroffsets) > 0:
+                        seqlens.append(seqlen)
+                        rawlens.append(offset - seqoffsets[-1])
+                        linebases.append(lbases)
+                        linewidths.append(lwidth)
+                    (acc, pid) = parse_header_ids(line.decode(errors='replace'))
+                    acclist.append(acc)
+                    pidlist.append(pid)
+                    hdroffsets.append(offset)
+                    seqoffsets.append(offset + len(line))
+                    seqlen = 0
+                    lbases = 0
+                    lwidth = 0
+                elif len(hdroffsets) > 0:
+                    s = line.rstrip()
+                    if lwidth == 0:
+                        lbases = len(s)
+                        lwidth = len(line)
+                    seqlen += len(s)
+                offset += len(line)
+        if len(hdroffsets) > 0:
+            seqlens.append(seqlen)
+            rawlens.append(offset - seqoffsets[-1])
+            linebases.append(lbases)
+            linewidths.append(lwidth)
+
+        acc = np.array(acclist, dtype=bytes)
+        order = np.argsort(acc, kind='stable')
+        pid = np.array(pidlist, dtype=bytes)[order]
+        self.index = { 'acc'       : acc[order],
+                       'pid'       : pid,
+                       'pidorder'  : np.argsort(pid, kind='stable'),
+                       'hdroffset' : np.array(hdroffsets, dtype=np.int64)[order],
+                       'seqoffset' : np.array(seqoffsets, dtype=np.int64)[order],
+                       'seqlen'    : np.array(seqlens, dtype=np.int64)[order],
+                       'rawlen'    : np.array(rawlens, dtype=np.int64)[order],
+                       'linebases' : np.array(linebases, dtype=np.int32)[order],
+                       'linewidth' : np.array(linewidths, dtype=np.int32)[order] }
+        self.log.info(f"indexed {len(acc)} records in {self.filepath}")
+
+    def save(self):
+        try:
+            np.savez(self.indexpath, **self.index)
+            self.log.debug(f"saved index to {self.indexpath}")
+        except IOError:
+            self.log.warning(f"unable to write index {self.indexpath}. Using in memory.")
+
+    def lookup(self, keylist, key='acc'):
+        """
+        Returns array of index positions for keys, -1 where missing.
+        key is 'acc' or 'pid'
+        """
+        keys = np.array(list(keylist), dtype=bytes)
+        if key == 'acc':
+            skeys = self.index['acc']
+            order = None
+        else:
+            order = self.index['pidorder']
+            skeys = self.index['pid'][order]
+        if len(skeys) == 0 or len(keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.searchsorted(skeys, keys)
+        pos[pos >= len(skeys)] = 0
+        found = skeys[pos] == keys
+        if order is not None:
+            pos = order[pos]
+        pos[~found] = -1
+        return pos
+
+    def read_sequence(self, f, i):
+        f.seek(self.index['seqoffset'][i])
+        raw = f.read(self.index['rawlen'][i])
+        return b''.join(raw.split()).decode()
+
+    def fetch(self, acc, key='acc'):
+        """
+        Sequence string for acc. Raises KeyError if not in index.
+        """
+        i = self.lookup([acc], key=key)[0]
+        if i < 0:
+            raise KeyError(acc)
+        with open(self.filepath, 'rb') as f:
+            return self.read_sequence(f, i)
+
+    def fetch_header(self, acc, key='acc'):
+        i = self.lookup([acc], key=key)[0]
+        if i < 0:
+            raise KeyError(acc)
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.index['hdroffset'][i])
+            return f.readline().decode().strip()
+
+    def fetch_many(self, keylist, key='acc'):
+        """
+        Returns dict key -> sequence for all keys found. Missing keys are logged and omitted.
+        Records are read in file order.
+        """
+        keylist = list(dict.fromkeys(keylist))
+        pos = self.lookup(keylist, key=key)
+        nmissing = int((pos < 0).sum())
+        if nmissing > 0:
+            self.log.debug(f"{nmissing} of {len(keylist)} keys not in {self.filepath}")
+        found = np.flatnonzero(pos >= 0)
+        found = found[np.argsort(self.index['seqoffset'][pos[found]], kind='stable')]
+        seqmap = {}
+        with open(self.filepath, 'rb') as f:
+            for j in found:
+                seqmap[keylist[j]] = self.read_sequence(f, pos[j])
+        self.log.debug(f"fetched {len(seqmap)} sequences, {nmissing} missing.")
+        return seqmap
+
+
+if __name__ == '__main__':
+    FORMAT='%(asctime)s (UTC) [ %(levelname)s ] %(filename)s:%(lineno)d %(name)s.%(funcName)s(): %(message)s'
+    logging.basicConfig(format=FORMAT)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-d', '--debug',
+                        action="store_true",
+                        dest='debug',
+                        help='debug logging')
+
+    parser.add_argument('-v', '--verbose',
+                        action="store_true",
+                        dest='verbose',
+                        help='verbose logging')
+
+    parser.add_argument('command',
+                        metavar='command',
+                        type=str,
+                        choices=['index', 'fetch'],
+                        help='index | fetch')
+
+    parser.add_argument('fastafile',
+                        metavar='fastafile',
+                        type=str,
+                        help='a .fasta sequence file')
+
+    parser.add_argument('accessions',
+                        metavar='accessions',
+                        type=str,
+                        nargs='*',
+                        help='accessions to fetch')
+
+    args= parser.parse_args()
+
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    fi = FastaIndex(args.fastafile)
+    if args.command == 'index':
+        print(fi)
+    elif args.command == 'fetch':
+        seqmap = fi.fetch_many(args.accessions)
+        for acc in args.accessions:
+            if acc in seqmap:
+                print(fi.fetch_header(acc))
+                print(seqmap[acc])
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+#
+#  Shared, append-safe result table for array job tasks.
+#
+#  Each task appends fixed-schema rows tagged with its task id, and downstream reads
+#  one table instead of thousands of per-task files. A re-run task replaces its own
+#  rows, so retries never duplicate results.
+#
+#  Two backends, by path:
+#     <name>.sqlite | <name>.db   SQLite table in WAL mode. Concurrent writers are
+#                                 serialized by SQLite locking. Writers should share
+#                                 one host (e.g. elzar.run_array), since WAL does not
+#                                 work over NFS.
+#     <name>                      Parquet dataset directory, one part file per task,
+#                                 written to temp name then renamed. Safe for grid
+#                                 tasks on many hosts over NFS.
+#
+#  A whole run that re-cuts its tasks should clear() first, so rows of old task ids
+#  don't linger next to the new ones.
+#
+#  resultsink.py dump <path> <table>      rows as TSV
+#
+
+import argparse
+import glob
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ARROW_TYPES = { 'TEXT'    : pa.string(),
+                'INTEGER' : pa.int64(),
+                'REAL'    : pa.float64() }
+
+
+class ResultSink(object):
+    """
+    sink = ResultSink('~/work/ends.sqlite', 'ends', [('filename','TEXT'), ('count','INTEGER')])
+    sink.append(rows, taskid)      rows are tuples in column order
+    df = sink.read_df()            all tasks' rows, with taskid column
+
+    With no columns, sink is read-only and must already exist.
+    """
+
+    def __init__(self, path, table, columns, timeout=600):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.table = table
+        self.columns = list(columns)
+        self.timeout = timeout
+        self.conn = None
+        if len(self.columns) == 0 and not os.path.exists(self.path):
+            raise FileNotFoundError(f"no result sink at {self.path}")
+        if self.is_sqlite():
+            self.open_sqlite()
+
+    def __repr__(self):
+        return f"ResultSink: {self.path} table={self.table}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def is_sqlite(self):
+        return self.path.endswith('.sqlite') or self.path.endswith('.db')
+
+    def open_sqlite(self):
+        self.conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        if len(self.columns) == 0:
+            # read-only use, table must exist.
+            return
+        coldefs = ', '.join([ f"{name} {ctype}" for (name, ctype) in self.columns ])
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (taskid INTEGER, {coldefs})")
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_taskid ON {self.table} (taskid)")
+
+    def get_schema(self):
+        return pa.schema([ pa.field('taskid', pa.int64()) ] +
+                         [ pa.field(name, ARROW_TYPES[ctype]) for (name, ctype) in self.columns ])
+
+    def append(self, rows, taskid):
+        """
+        Replaces rows of taskid with rows, atomically.
+        """
+        rows = [ tuple(r) for r in rows ]
+        if self.is_sqlite():
+            self.append_sqlite(rows, taskid)
+        else:
+            self.append_parquet(rows, taskid)
+        self.log.debug(f"wrote {len(rows)} rows for task {taskid} to {self.path}")
+
+    def append_sqlite(self, rows, taskid):
+        marks = ','.join(['?'] * (len(self.columns) + 1))
+        # busy timeout covers normal contention. retry for writers starved past it.
+        for attempt in range(5):
+            try:
+                self.conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self.conn.execute(f"DELETE FROM {self.table} WHERE taskid = ?", (taskid,))
+                    self.conn.executemany(f"INSERT INTO {self.table} VALUES ({marks})",
+                                          [ (taskid,) + r for r in rows ])
+                    self.conn.execute('COMMIT')
+                except Exception:
+                    self.conn.execute('ROLLBACK')
+                    raise
+                return
+            except sqlite3.OperationalError as oe:
+                if 'locked' not in str(oe) and 'busy' not in str(oe):
+                    raise
+                self.log.warning(f"{self.path} busy, retrying task {taskid} write...")
+                time.sleep(1 + attempt)
+        raise RuntimeError(f"could not write task {taskid} rows to {self.path}")
+
+    def clear(self):
+        """
+        Removes rows of all tasks.
+        """
+        if self.is_sqlite():
+            self.conn.execute(f"DELETE FROM {self.table}")
+        else:
+            for partpath in self.get_parts():
+                os.remove(partpath)
+        self.log.debug(f"cleared table {self.table} in {self.path}")
+
+    def get_parts(self):
+        return glob.glob(f"{glob.escape(self.path)}/{self.table}.*.parquet")
+
+    def append_parquet(self, rows, taskid):
+        names = [ name for (name, ctype) in self.columns ]
+        data = { 'taskid' : [taskid] * len(rows) }
+        for (i, name) in enumerate(names):
+            data[name] = [ r[i] for r in rows ]
+        table = pa.table(data, schema=self.get_schema())
+        partpath = f"{self.path}/{self.table}.{taskid}.parquet"
+        tmppath = f"{partpath}.{os.getpid()}.tmp"
+        os.makedirs(self.path, exist_ok=True)
+        pq.write_table(table, tmppath)
+        os.replace(tmppath, partpath)
+
+    def read_df(self):
+        """
+        All rows as DataFrame, ordered by taskid then insertion.
+        """
+        if self.is_sqlite():
+            return pd.read_sql_query(f"SELECT * FROM {self.table} ORDER BY taskid, rowid", self.conn)
+        partlist = self.get_parts()
+        if len(partlist) == 0:
+            return self.get_schema().empty_table().to_pandas()
+        df = pd.concat([ pq.read_table(p).to_pandas() for p in partlist ], ignore_index=True)
+        return df.sort_values('taskid', kind='stable').reset_index(drop=True)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+if __name__ == '__main__':
+    FORMAT='%(asctime)s (UTC) [ %(levelname)s ] %(filename)s:%(lineno)d %(name)s.%(funcName)s(): %(message)s'
+    logging.basicConfig(format=FORMAT)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-d', '--debug',
+                        action="store_true",
+                        dest='debug',
+                        help='debug logging')
+
+    parser.add_argument('-v', '--verbose',
+                        action="store_true",
+                        dest='verbose',
+                        help='verbose logging')
+
+    parser.add_argument('command',
+                        metavar='command',
+                        type=str,
+                        choices=['dump'],
+                        help='dump')
+
+    parser.add_argument('path',
+                        metavar='path',
+                        type=str,
+                        help='.sqlite file or Parquet dataset directory')
+
+    parser.add_argument('table',
+                        metavar='table',
+                        type=str,
+                        help='table name')
+
+    args= parser.parse_args()
+
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    if args.command == 'dump':
+        # schema comes from stored data, so none needed to read.
+        try:
+            sink = ResultSink(args.path, args.table, [])
+        except FileNotFoundError as fnfe:
+            logging.error(f"{fnfe}")
+            sys.exit(1)
+        sink.read_df().to_csv(sys.stdout, sep='\t', index=False)
+        sink.close()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+#
+#  Packed, memory-mapped proteome store.
+#
+#  A sequence DB is a directory:
+#     residues.bin    uint8, all sequences concatenated, in input file order
+#     headers.bin     uint8, all header lines (no '>') concatenated
+#     acc.npy         sorted accessions. Record i below is acc[i].
+#     start.npy       int64 offset of record i in residues.bin
+#     length.npy      int64 length of record i
+#     hstart.npy      int64 offset of header i in headers.bin
+#     hlength.npy     int64 length of header i
+#     ox.npy          int32 taxon id of record i, -1 if none
+#     pid.bin db.bin gn.bin           header metadata strings, UTF-8, concatenated in
+#     pid.off.npy db.off.npy gn.off.npy   record order. String i is bin[off[i]:off[i + 1]]
+#
+#  Everything is opened read-only memory-mapped, so any number of worker processes
+#  share one copy through the page cache, and sequence slices are zero-copy views.
+#
+#  seqdb.py build   <fasta> <dbdir>
+#  seqdb.py convert <dbdir> <outfasta> [-a <accfile>]
+#  seqdb.py info    <dbdir>
+#
+
+import argparse
+import logging
+import os
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+gitpath=os.path.expanduser("~/git/cshl-work")
+sys.path.append(gitpath)
+
+from utils.fastatool import FastaIndex, FastaRecord, FastaWriter, read_fasta
+
+
+ARRAYS = ['acc', 'start', 'length', 'hstart', 'hlength', 'ox']
+STRINGS = ['pid', 'db', 'gn']
+
+
+class SequenceDB(object):
+    """
+    sdb = SequenceDB('~/data/uniprot/sprot.seqdb')
+    seq = sdb.get_sequence('Q8CJG1')
+    res = sdb.get_residues('Q8CJG1')     # uint8 view, no copy
+    seqmap = sdb.fetch_many(acclist)
+    gn = sdb.get_string('gn', sdb.get_index('Q8CJG1'))
+
+    """
+
+    def __init__(self, dbdir):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.dbdir = os.path.abspath(os.path.expanduser(dbdir))
+        self.open()
+
+    def __repr__(self):
+        return f"SequenceDB: {self.dbdir} {len(self)} records, {len(self.residues)} residues"
+
+    def __len__(self):
+        return len(self.acc)
+
+    def __contains__(self, acc):
+        return self.lookup([acc])[0] >= 0
+
+    def __getstate__(self):
+        # pickle as path only. workers re-open their own maps of the same files.
+        return { 'dbdir' : self.dbdir }
+
+    def __setstate__(self, state):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.dbdir = state['dbdir']
+        self.open()
+
+    def open(self):
+        for name in ARRAYS:
+            setattr(self, name, np.load(f"{self.dbdir}/{name}.npy", mmap_mode='r'))
+        self.strings = { name : ( self.open_buffer(f"{name}.bin"), 
+                                  np.load(f"{self.dbdir}/{name}.off.npy", mmap_mode='r') )
+                         for name in STRINGS }
+        self.residues = self.open_buffer('residues.bin')
+        self.headers = self.open_buffer('headers.bin')
+        self.log.debug(f"opened {self}")
+
+    def open_buffer(self, filename):
+        filepath = f"{self.dbdir}/{filename}"
+        if os.path.getsize(filepath) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(filepath, dtype=np.uint8, mode='r')
+
+    def lookup(self, acclist):
+        """
+        Returns array of record numbers, -1 where missing.
+        """
+        keys = np.array(list(acclist), dtype=bytes)
+        if len(self.acc) == 0 or len(keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.searchsorted(self.acc, keys)
+        pos[pos >= len(self.acc)] = 0
+        pos[self.acc[pos] != keys] = -1
+        return pos
+
+    def get_index(self, acc):
+        i = self.lookup([acc])[0]
+        if i < 0:
+            raise KeyError(acc)
+        return i
+
+    def residues_at(self, i):
+        start = self.start[i]
+        return self.residues[start:start + self.length[i]]
+
+    def header_at(self, i):
+        hstart = self.hstart[i]
+        return self.headers[hstart:hstart + self.hlength[i]].tobytes().decode()
+
+    def get_string(self, name, i):
+        """
+        Metadata string of record i, name one of STRINGS. 
+        """
+        (buf, off) = self.strings[name]
+        return buf[off[i]:off[i + 1]].tobytes().decode()
+
+    def get_residues(self, acc):
+        """
+        uint8 view of sequence in the mapped residue buffer.
+        """
+        return self.residues_at(self.get_index(acc))
+
+    def get_sequence(self, acc):
+        return self.get_residues(acc).tobytes().decode()
+
+    def get_header(self, acc):
+        return self.header_at(self.get_index(acc))
+
+    def fetch_many(self, acclist):
+        """
+        dict acc -> sequence string for all accessions found.
+        """
+        acclist = list(acclist)
+        pos = self.lookup(acclist)
+        seqmap = {}
+        for (acc, i) in zip(acclist, pos):
+            if i >= 0:
+                seqmap[acc] = self.residues_at(i).tobytes().decode()
+        self.log.debug(f"fetched {len(seqmap)} of {len(acclist)} sequences.")
+        return seqmap
+
+    def iter_records(self, acclist=None):
+        """
+        Yields FastaRecords, in accession order or acclist order. Missing accessions skipped.
+        """
+        if acclist is None:
+            pos = range(len(self))
+        else:
+            pos = [ i for i in self.lookup(acclist) if i >= 0 ]
+        for i in pos:
+            yield FastaRecord(self.header_at(i), self.residues_at(i).tobytes().decode())
+
+    def to_fasta(self, outfile, acclist=None, linewidth=60):
+        with FastaWriter(outfile, linewidth=linewidth) as fw:
+            fw.write_records(self.iter_records(acclist))
+        self.log.info(f"wrote {fw.numwritten} sequences to {outfile}")
+
+    @classmethod
+    def build(cls, fastafile, dbdir):
+        """
+        Single streaming pass over fastafile. Residues and headers are written straight
+        to their buffers. Only per-record metadata is held in memory, then sorted by
+        accession.
+        """
+        log = logging.getLogger(cls.__name__)
+        dbdir = os.path.abspath(os.path.expanduser(dbdir))
+        if not os.path.exists(dbdir):
+            os.makedirs(dbdir)
+        cols = { name : [] for name in ARRAYS + STRINGS }
+        roffset = 0
+        hoffset = 0
+        with open(f"{dbdir}/residues.bin", 'wb') as rf, open(f"{dbdir}/headers.bin", 'wb') as hf:
+            for rec in read_fasta(fastafile):
+                seq = rec.sequence.encode()
+                hdr = rec.header.encode()
+                rf.write(seq)
+                hf.write(hdr)
+                cols['acc'].append(rec.accession)
+                cols['start'].append(roffset)
+                cols['length'].append(len(seq))
+                cols['hstart'].append(hoffset)
+                cols['hlength'].append(len(hdr))
+                cols['pid'].append(rec.pid)
+                cols['db'].append(rec.db or '')
+                cols['gn'].append(rec.tags.get('GN', ''))
+                cols['ox'].append(rec.tags.get('OX', '-1'))
+                roffset += len(seq)
+                hoffset += len(hdr)
+                if len(cols['acc']) % 1000000 == 0:
+                    log.info(f"packed {len(cols['acc'])} records...")
+
+        acc = np.array(cols['acc'], dtype=bytes)
+        order = np.argsort(acc, kind='stable')
+        arrays = { 'acc'     : acc,
+                   'start'   : np.array(cols['start'], dtype=np.int64),
+                   'length'  : np.array(cols['length'], dtype=np.int64),
+                   'hstart'  : np.array(cols['hstart'], dtype=np.int64),
+                   'hlength' : np.array(cols['hlength'], dtype=np.int64),
+                   'ox'      : np.array([ int(x) if x.isdigit() else -1 for x in cols['ox'] ], dtype=np.int32) }
+        for (name, a) in arrays.items():
+            np.save(f"{dbdir}/{name}.npy", a[order])
+        # headers may hold any UTF-8, so strings go to offset buffers, not fixed-width bytes.
+        for name in STRINGS:
+            values = cols.pop(name)
+            encoded = [ values[i].encode() for i in order ]
+            off = np.zeros(len(encoded) + 1, dtype=np.int64)
+            off[1:] = np.cumsum([ len(e) for e in encoded ], dtype=np.int64)
+            with open(f"{dbdir}/{name}.bin", 'wb') as f:
+                f.write(b''.join(encoded))
+            np.save(f"{dbdir}/{name}.off.npy", off)
+        log.info(f"built sequence db {dbdir} with {len(acc)} records, {roffset} residues.")
+        return cls(dbdir)
+
+
+def get_sequence_source(path):
+    """
+    SequenceDB if path is a built db directory, otherwise FastaIndex of FASTA file.
+    Both provide fetch_many(acclist) -> { acc : sequence }
+    """
+    path = os.path.expanduser(path)
+    if os.path.isdir(path):
+        return SequenceDB(path)
+    return FastaIndex(path)
+
+
+def fetch_many_parallel(source, acclist, nthreads=4):
+    """
+    fetch_many() over nthreads slices of acclist at once. Each FastaIndex call opens 
+    its own handle and SequenceDB reads are memory-mapped, so either source is safe 
+    to share between threads. 
+    """
+    acclist = list(dict.fromkeys(acclist))
+    nthreads = max(1, min(nthreads, len(acclist)))
+    if nthreads == 1:
+        return source.fetch_many(acclist)
+    step = -(-len(acclist) // nthreads)
+    seqmap = {}
+    with ThreadPoolExecutor(max_workers=nthreads) as ex:
+        for part in ex.map(source.fetch_many, [ acclist[i:i + step] for i in range(0, len(acclist), step) ]):
+            seqmap.update(part)
+    return seqmap
+
+
+if __name__ == '__main__':
+    FORMAT='%(asctime)s (UTC) [ %(levelname)s ] %(filename)s:%(lineno)d %(name)s.%(funcName)s(): %(message)s'
+    logging.basicConfig(format=FORMAT)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-d', '--debug',
+                        action="store_true",
+                        dest='debug',
+                        help='debug logging')
+
+    parser.add_argument('-v', '--verbose',
+                        action="store_true",
+                        dest='verbose',
+                        help='verbose logging')
+
+    parser.add_argument('-a', '--accfile',
+                        action="store",
+                        dest='accfile',
+                        default=None,
+                        help='convert: only accessions listed in file, one per line')
+
+    parser.add_argument('command',
+                        metavar='command',
+                        type=str,
+                        choices=['build', 'convert', 'info'],
+                        help='build <fasta> <dbdir> | convert <dbdir> <fasta> | info <dbdir>')
+
+    parser.add_argument('paths',
+                        metavar='paths',
+                        type=str,
+                        nargs='+',
+                        help='input and output paths')
+
+    args= parser.parse_args()
+
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    if args.command == 'build':
+        sdb = SequenceDB.build(args.paths[0], args.paths[1])
+        print(sdb)
+    elif args.command == 'convert':
+        sdb = SequenceDB(args.paths[0])
+        acclist = None
+        if args.accfile is not None:
+            with open(args.accfile) as f:
+                acclist = [ line.strip() for line in f if len(line.strip()) > 0 ]
+        sdb.to_fasta(args.paths[1], acclist)
+    elif args.command == 'info':
+        print(SequenceDB(args.paths[0]))
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+#
+#  Persistent accession index for UniProt .dat flat files.
+#
+#  Streams the .dat file once, recording for each entry its primary and secondary
+#  accessions, ID, gene name, taxon, GO cross-references and byte offset, into an
+#  SQLite index <datfile>.sqlite next to it. Rebuilt only when the .dat changes.
+#
+#  ID   ASM_MOUSE               Reviewed;         627 AA.
+#  AC   Q04519; Q3TB46; Q60723; Q8VCF7;
+#  GN   Name=Smpd1; Synonyms=Asm;
+#  OX   NCBI_TaxID=10090;
+#  DR   GO; GO:0005764; C:lysosome; IDA:MGI.
+#  //
+#
+#  uniprotdat.py index   <datfile>
+#  uniprotdat.py resolve <datfile> <acc> [<acc> ...]
+#
+
+import argparse
+import logging
+import os
+import sqlite3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entry (
+    eid INTEGER PRIMARY KEY,
+    acc TEXT,
+    id TEXT,
+    gn TEXT,
+    taxonid INTEGER,
+    offset INTEGER,
+    length INTEGER
+);
+CREATE TABLE IF NOT EXISTS accession (
+    acc TEXT PRIMARY KEY,
+    eid INTEGER,
+    isprimary INTEGER
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS goterm (
+    eid INTEGER,
+    goterm TEXT,
+    goev TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def parse_dat_entries(filename):
+    """
+    Streams entries from .dat file as dicts:
+        { 'acclist' : ['Q04519', 'Q3TB46', ...],   # primary first
+          'id' : 'ASM_MOUSE', 'gn' : 'Smpd1', 'taxonid' : 10090,
+          'goterms' : [('GO:0005764', 'IDA'), ...],
+          'offset' : <byte offset of ID line>, 'length' : <bytes through //> }
+    """
+    current = None
+    offset = 0
+    with open(filename, 'rb') as f:
+        for bline in f:
+            code = bline[:2]
+            if code == b'ID':
+                current = { 'acclist' : [],
+                            'id' : bline[5:].split()[0].decode(),
+                            'gn' : None,
+                            'taxonid' : None,
+                            'goterms' : [],
+                            'offset' : offset }
+            elif current is None:
+                pass
+            elif code == b'AC':
+                current['acclist'].extend([ a.strip() for a in bline[5:].decode().split(';') if a.strip() ])
+            elif code == b'GN':
+                if current['gn'] is None:
+                    for t in bline[5:].decode().split(';'):
+                        t = t.strip()
+                        if t.startswith('Name='):
+                            current['gn'] = t[5:].split('{')[0].strip()
+                            break
+            elif code == b'OX':
+                # OX   NCBI_TaxID=10090;
+                t = bline[5:].decode().split(';')[0].split('=')
+                if len(t) > 1:
+                    try:
+                        current['taxonid'] = int(t[1].split()[0])
+                    except ValueError:
+                        pass
+            elif code == b'DR':
+                # DR   GO; GO:0005764; C:lysosome; IDA:MGI.
+                if bline[5:8] == b'GO;':
+                    fields = [ x.strip() for x in bline[5:].decode().split(';') ]
+                    goev = fields[3].split(':')[0] if len(fields) > 3 else None
+                    current['goterms'].append((fields[1], goev))
+            elif code == b'//':
+                current['length'] = offset + len(bline) - current['offset']
+                yield current
+                current = None
+            offset += len(bline)
+
+
+class UniprotDatIndex(object):
+    """
+    udi = UniprotDatIndex('~/data/uniprot/uniprot_all_rodents.dat')
+    udi.resolve(['Q3TB46', 'P12345'])     ->  { 'Q3TB46' : 'Q04519', ... }
+    udi.get_entry('Q3TB46')               ->  { 'acc' : 'Q04519', 'id' : 'ASM_MOUSE', ... }
+    udi.get_goterms('Q04519')             ->  [ ('GO:0005764', 'IDA'), ... ]
+    udi.get_record('Q04519')              ->  raw .dat text of entry
+
+    """
+
+    def __init__(self, datfile, indexpath=None):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.datfile = os.path.abspath(os.path.expanduser(datfile))
+        if indexpath is None:
+            indexpath = f"{self.datfile}.sqlite"
+        self.indexpath = indexpath
+        self.conn = None
+        self.load()
+
+    def __repr__(self):
+        return f"UniprotDatIndex: {self.datfile} {len(self)} entries"
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM entry').fetchone()[0]
+
+    def __contains__(self, acc):
+        return self.conn.execute('SELECT 1 FROM accession WHERE acc = ?', (acc,)).fetchone() is not None
+
+    def source_stamp(self):
+        st = os.stat(self.datfile)
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    def is_current(self):
+        if not os.path.exists(self.indexpath):
+            return False
+        try:
+            conn = sqlite3.connect(self.indexpath)
+            row = conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+            conn.close()
+        except sqlite3.Error:
+            return False
+        return row is not None and row[0] == self.source_stamp()
+
+    def load(self):
+        if not self.is_current():
+            self.build()
+        self.conn = sqlite3.connect(self.indexpath)
+        self.log.debug(f"opened index {self.indexpath}")
+
+    def build(self, batchsize=10000):
+        self.log.info(f"building index for {self.datfile} ...")
+        tmppath = f"{self.indexpath}.tmp"
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        conn = sqlite3.connect(tmppath)
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.executescript(SCHEMA)
+
+        entries = []
+        accs = []
+        gos = []
+        eid = 0
+        for e in parse_dat_entries(self.datfile):
+            if len(e['acclist']) == 0:
+                continue
+            entries.append((eid, e['acclist'][0], e['id'], e['gn'], e['taxonid'], e['offset'], e['length']))
+            accs.append((e['acclist'][0], eid, 1))
+            for alt in e['acclist'][1:]:
+                accs.append((alt, eid, 0))
+            for (gt, ev) in e['goterms']:
+                gos.append((eid, gt, ev))
+            eid += 1
+            if len(entries) >= batchsize:
+                self.insert(conn, entries, accs, gos)
+                entries, accs, gos = [], [], []
+                if eid % 1000000 == 0:
+                    self.log.info(f"indexed {eid} entries...")
+        self.insert(conn, entries, accs, gos)
+        conn.execute('CREATE INDEX IF NOT EXISTS goterm_eid ON goterm (eid)')
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('source', ?)", (self.source_stamp(),))
+        conn.commit()
+        conn.close()
+        os.replace(tmppath, self.indexpath)
+        self.log.info(f"indexed {eid} entries from {self.datfile} to {self.indexpath}")
+
+    def insert(self, conn, entries, accs, gos):
+        conn.executemany('INSERT INTO entry VALUES (?,?,?,?,?,?,?)', entries)
+        # secondary accessions may be shared by merged entries. first one wins, primaries win.
+        conn.executemany('INSERT OR REPLACE INTO accession VALUES (?,?,?)', [ a for a in accs if a[2] == 1 ])
+        conn.executemany('INSERT OR IGNORE INTO accession VALUES (?,?,?)', [ a for a in accs if a[2] == 0 ])
+        conn.executemany('INSERT INTO goterm VALUES (?,?,?)', gos)
+        conn.commit()
+
+    def query_accessions(self, acclist, columns, chunksize=500):
+        acclist = list(acclist)
+        rows = []
+        for i in range(0, len(acclist), chunksize):
+            chunk = acclist[i:i + chunksize]
+            marks = ','.join(['?'] * len(chunk))
+            sql = f'SELECT a.acc, {columns} FROM accession a JOIN entry e ON a.eid = e.eid WHERE a.acc IN ({marks})'
+            rows.extend(self.conn.execute(sql, chunk).fetchall())
+        return rows
+
+    def resolve(self, acclist):
+        """
+        Returns dict acc -> primary accession, for all acclist found (primary or secondary).
+        """
+        return { acc : primary for (acc, primary) in self.query_accessions(acclist, 'e.acc') }
+
+    def get_entry(self, acc):
+        """
+        Entry for primary or secondary acc, as dict. Raises KeyError.
+        """
+        rows = self.query_accessions([acc], 'e.eid, e.acc, e.id, e.gn, e.taxonid, e.offset, e.length')
+        if len(rows) == 0:
+            raise KeyError(acc)
+        (a, eid, primary, pid, gn, taxonid, offset, length) = rows[0]
+        alts = [ r[0] for r in self.conn.execute('SELECT acc FROM accession WHERE eid = ? AND isprimary = 0', (eid,)) ]
+        return { 'acc' : primary, 'altaccs' : alts, 'id' : pid, 'gn' : gn,
+                 'taxonid' : taxonid, 'offset' : offset, 'length' : length }
+
+    def get_goterms(self, acc):
+        rows = self.query_accessions([acc], 'e.eid')
+        if len(rows) == 0:
+            raise KeyError(acc)
+        return self.conn.execute('SELECT goterm, goev FROM goterm WHERE eid = ?', (rows[0][1],)).fetchall()
+
+    def get_record(self, acc):
+        """
+        Raw .dat text of entry, read by offset.
+        """
+        e = self.get_entry(acc)
+        with open(self.datfile, 'rb') as f:
+            f.seek(e['offset'])
+            return f.read(e['length']).decode()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+if __name__ == '__main__':
+    FORMAT='%(asctime)s (UTC) [ %(levelname)s ] %(filename)s:%(lineno)d %(name)s.%(funcName)s(): %(message)s'
+    logging.basicConfig(format=FORMAT)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-d', '--debug',
+                        action="store_true",
+                        dest='debug',
+                        help='debug logging')
+
+    parser.add_argument('-v', '--verbose',
+                        action="store_true",
+                        dest='verbose',
+                        help='verbose logging')
+
+    parser.add_argument('command',
+                        metavar='command',
+                        type=str,
+                        choices=['index', 'resolve'],
+                        help='index | resolve')
+
+    parser.add_argument('datfile',
+                        metavar='datfile',
+                        type=str,
+                        help='a UniProt .dat file')
+
+    parser.add_argument('accessions',
+                        metavar='accessions',
+                        type=str,
+                        nargs='*',
+                        help='accessions to resolve')
+
+    args= parser.parse_args()
+
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    udi = UniprotDatIndex(args.datfile)
+    if args.command == 'index':
+        print(udi)
+    elif args.command == 'resolve':
+        amap = udi.resolve(args.accessions)
+        for acc in args.accessions:
+            print(f"{acc}\t{amap.get(acc, 'NA')}")